@@ -3,7 +3,10 @@ Query preprocessing and expansion for RAG system
 """
 import logging
 import re
-from typing import List, Dict
+from functools import lru_cache
+from typing import List, Dict, Tuple
+
+import ahocorasick
 
 from utils.logger_config import setup_logger
 
@@ -29,18 +32,54 @@ MEDICAL_SYNONYMS = {
     'cold': ['hypothermia', 'freezing', 'frostbite'],
 }
 
+# Common stop words to ignore when extracting keywords
+STOP_WORDS = frozenset({
+    'is', 'am', 'are', 'what', 'how', 'do', 'to', 'the', 'a', 'an',
+    'my', 'i', 'on', 'for', 'with', 'from', 'and', 'or', 'should',
+    'can', 'will', 'having', 'have', 'has'
+})
+
+# Phrases that flag a query as a potential emergency
+EMERGENCY_KEYWORDS = (
+    'unconscious', 'not breathing', 'no pulse', 'severe bleeding',
+    'chest pain', 'heart attack', 'stroke', 'seizure', 'anaphylaxis',
+    'choking', 'poisoning', 'overdose', 'severe burn', 'head injury',
+    'spinal injury', 'can\'t breathe', 'blue', 'unresponsive'
+)
+
+# Single alternation so detection is one regex scan instead of one per keyword
+_EMERGENCY_RE = re.compile(
+    '|'.join(re.escape(k) for k in EMERGENCY_KEYWORDS),
+    re.IGNORECASE
+)
+
 
 class QueryProcessor:
     """Process and expand user queries for better retrieval"""
     
-    def __init__(self, medical_synonyms: Dict[str, List[str]] = None):
+    def __init__(self, medical_synonyms: Dict[str, List[str]] = None, cache_size: int = 2048):
         """
         Initialize query processor
         
         Args:
             medical_synonyms: Dictionary mapping medical terms to synonyms
+            cache_size: Number of results memoized per method
         """
         self.medical_synonyms = medical_synonyms or MEDICAL_SYNONYMS
+        
+        # One automaton finds every synonym key in a single pass over the query;
+        # values carry the dict position so expansions keep the table's order
+        self._synonym_ac = ahocorasick.Automaton()
+        for idx, term in enumerate(self.medical_synonyms):
+            self._synonym_ac.add_word(term, (idx, term))
+        self._synonym_ac.make_automaton()
+        
+        # Per-instance memoization: the same query is normalized and expanded
+        # more than once per request and repeats across requests
+        self._preprocess_cached = lru_cache(maxsize=cache_size)(self._preprocess_query)
+        self._expand_cached = lru_cache(maxsize=cache_size)(self._expand_query)
+        self._keywords_cached = lru_cache(maxsize=cache_size)(self._extract_keywords)
+        
         logger.debug(f"QueryProcessor initialized with {len(self.medical_synonyms)} synonym mappings")
     
     def preprocess_query(self, query: str) -> str:
@@ -53,6 +92,9 @@ class QueryProcessor:
         Returns:
             Preprocessed query
         """
+        return self._preprocess_cached(query)
+    
+    def _preprocess_query(self, query: str) -> str:
         # Convert to lowercase
         query = query.lower()
         
@@ -60,7 +102,7 @@ class QueryProcessor:
         query = ' '.join(query.split())
         
         # Remove trailing question marks and exclamation points
-        query = re.sub(r'[?!]+$', '', query).strip()
+        query = query.rstrip('?!').strip()
         
         return query
     
@@ -75,30 +117,30 @@ class QueryProcessor:
         Returns:
             List of expanded query variations
         """
-        expanded_queries = [query]
+        return list(self._expand_cached(query, max_expansions))
+    
+    def _expand_query(self, query: str, max_expansions: int) -> Tuple[str, ...]:
         query_lower = query.lower()
+        matched_terms = sorted({hit for _, hit in self._synonym_ac.iter(query_lower)})
+        if not matched_terms:
+            return (query,)
         
         # Add synonym expansions
-        for term, synonyms in self.medical_synonyms.items():
-            if term in query_lower:
-                for syn in synonyms[:max_expansions]:
-                    expanded = query_lower.replace(term, syn)
-                    if expanded not in expanded_queries:
-                        expanded_queries.append(expanded)
+        expanded_queries = [query]
+        for _, term in matched_terms:
+            for syn in self.medical_synonyms[term][:max_expansions]:
+                expanded = query_lower.replace(term, syn)
+                if expanded not in expanded_queries:
+                    expanded_queries.append(expanded)
         
-        return expanded_queries[:max_expansions]
+        return tuple(expanded_queries[:max_expansions])
     
     def extract_keywords(self, query: str) -> List[str]:
-       
-        # Common stop words to ignore
-        stop_words = {
-            'is', 'am', 'are', 'what', 'how', 'do', 'to', 'the', 'a', 'an', 
-            'my', 'i', 'on', 'for', 'with', 'from', 'and', 'or', 'should',
-            'can', 'will', 'having', 'have', 'has'
-        }
-        
+        return list(self._keywords_cached(query))
+    
+    def _extract_keywords(self, query: str) -> Tuple[str, ...]:
         words = query.lower().split()
-        keywords = [w for w in words if w not in stop_words and len(w) > 2]
+        keywords = tuple(w for w in words if w not in STOP_WORDS and len(w) > 2)
         
         return keywords
     
@@ -112,17 +154,9 @@ class QueryProcessor:
         Returns:
             True if emergency detected, False otherwise
         """
-        emergency_keywords = [
-            'unconscious', 'not breathing', 'no pulse', 'severe bleeding',
-            'chest pain', 'heart attack', 'stroke', 'seizure', 'anaphylaxis',
-            'choking', 'poisoning', 'overdose', 'severe burn', 'head injury',
-            'spinal injury', 'can\'t breathe', 'blue', 'unresponsive'
-        ]
-        
-        query_lower = query.lower()
-        for keyword in emergency_keywords:
-            if keyword in query_lower:
-                logger.warning(f"Emergency keyword detected in query: {keyword}")
-                return True
+        match = _EMERGENCY_RE.search(query)
+        if match:
+            logger.warning(f"Emergency keyword detected in query: {match.group(0).lower()}")
+            return True
         
         return False
\ No newline at end of file
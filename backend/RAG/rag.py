@@ -1,15 +1,25 @@
 import os
 import logging
+import threading
+import time
 import certifi
-from typing import List, Dict, Optional, Any
-from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Optional, Any, Iterator, Tuple
 from dotenv import load_dotenv
 
+import numpy as np
+from cachetools import TTLCache
 from pinecone import Pinecone
 from pymongo import MongoClient
-from collections import Counter
 
-from RAG.embeddings import EmbeddingGenerator
+try:
+    from pinecone.grpc import PineconeGRPC
+except ImportError:  # grpc extra not installed
+    PineconeGRPC = None
+from collections import Counter, namedtuple
+
+from RAG.embeddings import EmbeddingGenerator, QUERY_BATCH_SIZE
 from RAG.query_processor import QueryProcessor
 from RAG.response_generator import ResponseGenerator
 
@@ -17,6 +27,40 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Local FAISS index (IVF-PQ) settings; smaller corpora use an exact flat index
+LOCAL_INDEX_NLIST = 64
+LOCAL_INDEX_PQ_M = 48
+LOCAL_INDEX_NPROBE = 8
+LOCAL_INDEX_MIN_TRAIN_SIZE = LOCAL_INDEX_NLIST * 39
+
+_LocalMatch = namedtuple('_LocalMatch', ['id', 'score'])
+
+
+@lru_cache(maxsize=None)
+def _get_pinecone_client(api_key: str):
+    """Process-wide Pinecone client; gRPC keeps one persistent channel"""
+    if PineconeGRPC is not None:
+        return PineconeGRPC(api_key=api_key)
+    return Pinecone(api_key=api_key, pool_threads=10)
+
+
+@lru_cache(maxsize=None)
+def _get_mongo_client(uri: str) -> MongoClient:
+    """Process-wide MongoDB client with a connection pool sized for concurrent requests"""
+    # SSL fix for Python 3.11+ on Render
+    return MongoClient(
+        uri,
+        tls=True,
+        tlsCAFile=certifi.where(),
+        maxPoolSize=50,
+        serverSelectionTimeoutMS=30000,
+        connectTimeoutMS=20000,
+        socketTimeoutMS=20000,
+    )
+
+# Shared pool for overlapping network calls (Pinecone queries, MongoDB reads)
+_IO_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="rag-io")
+
 
 class FirstAidRAGAssistant:
     """Main RAG assistant combining all components"""
@@ -27,8 +71,11 @@ class FirstAidRAGAssistant:
         mongodb_uri: str = None,
         groq_api_key: str = None,
         biobert_model: str = "dmis-lab/biobert-v1.1",
+        query_model: str = None,
         index_name: str = "first-aid-assistant",
         groq_model: str = "llama-3.3-70b-versatile",
+        use_local_index: bool = None,
+        response_cache_ttl: int = 600,
         log_level: int = logging.INFO
     ):
         """
@@ -39,8 +86,12 @@ class FirstAidRAGAssistant:
             mongodb_uri: MongoDB connection URI
             groq_api_key: Groq API key
             biobert_model: BioBERT model identifier
+            query_model: Optional distilled model for query embeddings
             index_name: Pinecone index name
             groq_model: Groq model identifier
+            use_local_index: Serve searches from a local FAISS copy of the index
+                (defaults to the USE_LOCAL_INDEX environment variable)
+            response_cache_ttl: Seconds a history-free answer is reused
             log_level: Logging level
         """
         # Setup logging
@@ -62,39 +113,63 @@ class FirstAidRAGAssistant:
         logger.info("FIRST AID RAG ASSISTANT")
         
         # Initialize components
-        self.embedding_gen = EmbeddingGenerator(biobert_model)
+        self.embedding_gen = EmbeddingGenerator(
+            biobert_model,
+            query_model_name=query_model,
+            onnx_model_path=os.getenv('EMBEDDING_ONNX_PATH')
+        )
         self.query_processor = QueryProcessor()
         self.response_gen = ResponseGenerator(self.groq_api_key, groq_model)
         
         # Initialize Pinecone
         logger.info("Connecting to Pinecone...")
-        self.pc = Pinecone(api_key=self.pinecone_api_key)
+        self.pc = _get_pinecone_client(self.pinecone_api_key)
         self.index = self.pc.Index(index_name)
         stats = self.index.describe_index_stats()
         logger.info(f"Pinecone connected: {stats.total_vector_count} vectors")
         
-        # Initialize MongoDB with SSL fix for Python 3.11+ on Render
+        # Optional in-process ANN index; Pinecone stays the fallback
+        if use_local_index is None:
+            use_local_index = os.getenv('USE_LOCAL_INDEX', 'false').lower() == 'true'
+        self.local_index = None
+        if use_local_index:
+            try:
+                self.local_index = self._build_local_index()
+            except Exception as e:
+                logger.warning(f"Local index unavailable, using Pinecone: {e}")
+        
+        # Initialize MongoDB
         logger.info("Connecting to MongoDB...")
-        self.mongo_client = MongoClient(
-            self.mongodb_uri,
-            tls=True,
-            tlsCAFile=certifi.where(),
-            serverSelectionTimeoutMS=30000,
-            connectTimeoutMS=20000,
-            socketTimeoutMS=20000,
-        )
+        self.mongo_client = _get_mongo_client(self.mongodb_uri)
         self.db = self.mongo_client['first_aid_db']
         self.scenarios_collection = self.db['scenarios']
         self.chunks_collection = self.db['chunks']
         self.conversations_collection = self.db['conversations']
         self.chat_history_collection = self.db['chat_history']
         
+        # Index the hot lookups: history by conversation (sorted by time) and chunks by id.
+        # An ascending compound index also serves the descending timestamp sort.
+        self.chat_history_collection.create_index([('conversation_id', 1), ('timestamp', 1)])
+        # Same spec as scripts/pinecone.py, so startup never conflicts with it
+        self.chunks_collection.create_index('chunk_id', unique=True)
+        
         scenario_count = self.scenarios_collection.count_documents({})
         chunk_count = self.chunks_collection.count_documents({})
         logger.info(f"MongoDB connected: {scenario_count} scenarios, {chunk_count} chunks")
         
+        # In-flight request dedup and short-lived cache of complete answers
+        self._inflight: Dict[Tuple, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._response_cache = TTLCache(maxsize=1024, ttl=response_cache_ttl)
+        
         logger.info("First Aid Assistant Ready!")
     
+    def clear_response_cache(self) -> None:
+        """Drop cached answers, e.g. after the knowledge base is re-indexed"""
+        with self._inflight_lock:
+            self._response_cache.clear()
+        logger.info("Response cache cleared")
+    
     def search_relevant_chunks(
         self,
         query: str,
@@ -104,6 +179,9 @@ class FirstAidRAGAssistant:
         """
         Search for relevant chunks using semantic search
         
+        All query expansions are embedded together in a single batched
+        forward pass, then searched against the index.
+        
         Args:
             query: User query
             top_k: Number of results to return
@@ -115,39 +193,155 @@ class FirstAidRAGAssistant:
         # Preprocess query
         processed_query = self.query_processor.preprocess_query(query)
         
-        # Expand query
-        expanded_queries = self.query_processor.expand_query(processed_query)
+        # Expand query, except for emergencies where time to answer matters most
+        if self.query_processor.detect_emergency(processed_query):
+            expanded_queries = [processed_query]
+        else:
+            expanded_queries = self.query_processor.expand_query(processed_query)
+        
+        # Generate embeddings for all query variations in one batch
+        embeddings = self.embedding_gen.generate_batch_embeddings(
+            expanded_queries,
+            batch_size=QUERY_BATCH_SIZE,
+            is_query=True
+        )
+        
+        match_lists = self._query_index(embeddings, top_k)
         
-        # Generate embeddings for all query variations
-        all_results = []
-        for q in expanded_queries:
-            embedding = self.embedding_gen.generate_embedding(q)
+        # Keep matches as parallel arrays; only survivors become dicts
+        ids: List[str] = []
+        scores: List[float] = []
+        for matches in match_lists:
+            for match in matches:
+                ids.append(match.id)
+                scores.append(match.score)
+        
+        score_arr = np.asarray(scores, dtype=np.float32)
+        order = np.argsort(-score_arr, kind='stable')
+        
+        # Walk in score order so each chunk keeps its best-scoring match
+        seen_ids = set()
+        selected = []
+        for i in order:
+            if score_arr[i] < min_score or len(selected) >= top_k:
+                break
+            if ids[i] in seen_ids:
+                continue
+            seen_ids.add(ids[i])
+            selected.append(i)
+        
+        if not selected:
+            return []
+        
+        # The index returns ids and scores only; text and metadata come from
+        # the authoritative chunk store in a single $in round trip
+        docs = {
+            doc['chunk_id']: doc
+            for doc in self.get_full_chunks([ids[i] for i in selected])
+        }
+        
+        unique_results = []
+        for i in selected:
+            doc = docs.get(ids[i])
+            if doc is None:
+                logger.warning(f"Chunk {ids[i]} missing from MongoDB, skipping")
+                continue
+            unique_results.append({
+                'chunk_id': ids[i],
+                'score': scores[i],
+                'metadata': {**doc.get('metadata', {}), 'scenario_id': doc.get('scenario_id')},
+                'text': doc.get('text', '')
+            })
+        
+        return unique_results
+    
+    def _query_index(self, embeddings: List[np.ndarray], top_k: int) -> List[List[Any]]:
+        """
+        Run one nearest-neighbour search per embedding
+        
+        Args:
+            embeddings: Query embeddings
+            top_k: Matches per embedding
             
-            # Search Pinecone
-            results = self.index.query(
+        Returns:
+            One list of matches (id, score) per embedding
+        """
+        if self.local_index is not None:
+            try:
+                return self._query_local_index(embeddings, top_k)
+            except Exception as e:
+                logger.warning(f"Local index search failed, falling back to Pinecone: {e}")
+        
+        # Search Pinecone for every variation concurrently (I/O-bound round-trips)
+        responses = _IO_POOL.map(
+            lambda embedding: self.index.query(
                 vector=embedding.tolist(),
                 top_k=top_k,
-                include_metadata=True
+                include_metadata=False,
+                include_values=False
+            ),
+            embeddings
+        )
+        return [results.matches for results in responses]
+    
+    def _query_local_index(self, embeddings: List[np.ndarray], top_k: int) -> List[List[Any]]:
+        """Search all embeddings against the in-process FAISS index in one call"""
+        queries = np.vstack(embeddings).astype(np.float32)
+        distances, indices = self.local_index.search(queries, top_k)
+        
+        return [
+            [
+                _LocalMatch(self._local_ids[j], float(score))
+                for score, j in zip(row_scores, row_indices)
+                if j >= 0
+            ]
+            for row_scores, row_indices in zip(distances, indices)
+        ]
+    
+    def _build_local_index(self):
+        """
+        Mirror the Pinecone index into an in-process FAISS index
+        
+        Vectors are L2-normalized so inner product matches Pinecone's cosine
+        scores. Large corpora use IVF-PQ; small ones an exact flat index.
+        
+        Returns:
+            FAISS index, or None if Pinecone returned no vectors
+        """
+        import faiss
+        
+        logger.info("Building local FAISS index from Pinecone...")
+        ids: List[str] = []
+        vectors: List[List[float]] = []
+        for id_batch in self.index.list():
+            fetched = self.index.fetch(ids=list(id_batch))
+            for vector_id, vector in fetched.vectors.items():
+                ids.append(vector_id)
+                vectors.append(vector.values)
+        
+        if not ids:
+            logger.warning("Pinecone index is empty, local index disabled")
+            return None
+        
+        matrix = np.asarray(vectors, dtype=np.float32)
+        faiss.normalize_L2(matrix)
+        dim = matrix.shape[1]
+        
+        if len(ids) >= LOCAL_INDEX_MIN_TRAIN_SIZE and dim % LOCAL_INDEX_PQ_M == 0:
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFPQ(
+                quantizer, dim, LOCAL_INDEX_NLIST, LOCAL_INDEX_PQ_M, 8,
+                faiss.METRIC_INNER_PRODUCT
             )
-            
-            all_results.extend(results.matches)
+            index.train(matrix)
+            index.nprobe = LOCAL_INDEX_NPROBE
+        else:
+            index = faiss.IndexFlatIP(dim)
+        index.add(matrix)
         
-        # Deduplicate and sort by score
-        seen_ids = set()
-        unique_results = []
-        for match in all_results:
-            if match.id not in seen_ids and match.score >= min_score:
-                seen_ids.add(match.id)
-                unique_results.append({
-                    'chunk_id': match.id,
-                    'score': match.score,
-                    'metadata': match.metadata,
-                    'text': match.metadata.get('text', '')
-                })
-        
-        # Sort by score and return top results
-        unique_results.sort(key=lambda x: x['score'], reverse=True)
-        return unique_results[:top_k]
+        self._local_ids = ids
+        logger.info(f"Local index ready: {len(ids)} vectors ({type(index).__name__})")
+        return index
     
     def get_full_chunks(self, chunk_ids: List[str]) -> List[Dict[str, Any]]:
         """
@@ -159,9 +353,33 @@ class FirstAidRAGAssistant:
         Returns:
             List of full chunks
         """
-        chunks = list(self.chunks_collection.find({'chunk_id': {'$in': chunk_ids}}))
+        projection = {
+            '_id': 0, 'chunk_id': 1, 'scenario_id': 1,
+            'chunk_index': 1, 'text': 1, 'metadata': 1
+        }
+        chunks = list(self.chunks_collection.find({'chunk_id': {'$in': chunk_ids}}, projection))
         return chunks
     
+    def _get_conversation_history(self, conversation_id: str) -> List[Dict[str, str]]:
+        """
+        Load the last two exchanges of a conversation, oldest first
+        
+        Args:
+            conversation_id: Conversation ID
+            
+        Returns:
+            List of role/content messages
+        """
+        history = list(self.chat_history_collection.find(
+            {'conversation_id': conversation_id},
+            {'role': 1, 'content': 1, '_id': 0}
+        ).sort('timestamp', -1).limit(4))
+        
+        return [
+            {'role': msg['role'], 'content': msg['content']}
+            for msg in reversed(history)
+        ]
+    
     def answer_query(
         self,
         query: str,
@@ -186,39 +404,120 @@ class FirstAidRAGAssistant:
         if verbose:
             logger.setLevel(logging.DEBUG)
         
+        conversation_history, key, relevant_chunks = self._prepare_query(
+            query, conversation_id, top_k, min_score
+        )
+        
+        # Answers that depend on conversation history are never cached
+        cacheable = not conversation_history
+        if cacheable:
+            with self._inflight_lock:
+                cached = self._response_cache.get(key)
+            if cached is not None:
+                logger.info(f"Response cache hit: {query}")
+                return {**cached, 'query': query}
+        
+        # Singleflight: concurrent identical queries share one retrieval + LLM pass
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+        
+        if not is_leader:
+            logger.info(f"Joining in-flight request: {query}")
+            return {**future.result(), 'query': query}
+        
+        try:
+            result = self._answer_query(
+                query, conversation_history, top_k, min_score, relevant_chunks
+            )
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                if cacheable and future.exception() is None:
+                    self._response_cache[key] = future.result()
+                self._inflight.pop(key, None)
+        
+        return result
+    
+    def _prepare_query(
+        self,
+        query: str,
+        conversation_id: Optional[str],
+        top_k: int,
+        min_score: float
+    ) -> Tuple[Optional[List[Dict[str, str]]], Tuple, Optional[List[Dict[str, Any]]]]:
+        """
+        Load the conversation's recent history and build the request key
+        
+        A conversation with no history yet (e.g. one just opened by a
+        logged-in user) answers exactly like a standalone query, so it
+        shares the standalone key and its cache entries.
+        
+        When the cache cannot answer the query, retrieval runs while the
+        history read is in flight on the I/O pool and its chunks are
+        returned; otherwise chunks is None and retrieval is left to the
+        caller.
+        
+        Returns:
+            (conversation_history, key, relevant_chunks)
+        """
+        processed_query = self.query_processor.preprocess_query(query)
+        if not conversation_id:
+            return None, (processed_query, None, top_k, min_score), None
+        
+        with self._inflight_lock:
+            may_hit = (processed_query, None, top_k, min_score) in self._response_cache
+        
+        relevant_chunks = None
+        if may_hit:
+            # The cached answer applies only if the conversation has no history
+            conversation_history = self._get_conversation_history(conversation_id)
+        else:
+            # Retrieval stays on this thread: it fans out on _IO_POOL itself
+            history_future = _IO_POOL.submit(self._get_conversation_history, conversation_id)
+            relevant_chunks = self._retrieve(query, top_k, min_score)
+            conversation_history = history_future.result()
+        
+        key = (
+            processed_query,
+            conversation_id if conversation_history else None,
+            top_k,
+            min_score
+        )
+        return conversation_history, key, relevant_chunks
+    
+    def _retrieve(
+        self,
+        query: str,
+        top_k: int,
+        min_score: float
+    ) -> List[Dict[str, Any]]:
+        """Fetch the chunks relevant to a query"""
         logger.info(f"Query: {query}")
         
-        # Search for relevant chunks
         relevant_chunks = self.search_relevant_chunks(query, top_k, min_score)
         
         logger.info(f"Found {len(relevant_chunks)} relevant chunks")
-        
-        # Get conversation history if available
-        conversation_history = None
-        if conversation_id:
-            history = list(self.chat_history_collection.find(
-                {'conversation_id': conversation_id}
-            ).sort('timestamp', -1).limit(4))
-            
-            conversation_history = [
-                {'role': msg['role'], 'content': msg['content']}
-                for msg in reversed(history)
-            ]
-        
-        # Generate response
+        return relevant_chunks
+    
+    def _build_result(
+        self,
+        query: str,
+        response: str,
+        relevant_chunks: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Assemble the answer payload: confidence, sources and stats"""
         if relevant_chunks:
-            response = self.response_gen.generate_response(
-                query,
-                relevant_chunks,
-                conversation_history
-            )
-            
             # Calculate confidence
             avg_score = sum(c['score'] for c in relevant_chunks) / len(relevant_chunks)
             confidence = "high" if avg_score >= 0.75 else "medium" if avg_score >= 0.60 else "low"
         else:
-            logger.warning("No relevant chunks found, using fallback response")
-            response = self.response_gen.generate_fallback_response(query)
             avg_score = 0.0
             confidence = "low"
         
@@ -250,6 +549,94 @@ class FirstAidRAGAssistant:
         
         return result
     
+    def _answer_query(
+        self,
+        query: str,
+        conversation_history: Optional[List[Dict[str, str]]],
+        top_k: int,
+        min_score: float,
+        relevant_chunks: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        """Retrieve context (unless already retrieved) and generate the answer"""
+        if relevant_chunks is None:
+            relevant_chunks = self._retrieve(query, top_k, min_score)
+        
+        # Generate response
+        if relevant_chunks:
+            response = self.response_gen.generate_response(
+                query,
+                relevant_chunks,
+                conversation_history
+            )
+        else:
+            logger.warning("No relevant chunks found, using fallback response")
+            response = self.response_gen.generate_fallback_response(query)
+        
+        return self._build_result(query, response, relevant_chunks)
+    
+    def answer_query_stream(
+        self,
+        query: str,
+        conversation_id: Optional[str] = None,
+        top_k: int = 10,
+        min_score: float = 0.60
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Answer a first aid query, streaming the response as it is generated
+        
+        Args:
+            query: User query
+            conversation_id: Optional conversation ID
+            top_k: Number of chunks to retrieve
+            min_score: Minimum relevance score
+            
+        Yields:
+            {'type': 'token', 'content': str} for each response fragment, then
+            {'type': 'done', **result} where result matches answer_query and
+            its 'response' is the cleaned full text
+        
+        Shares answer_query's response cache (read and written for queries
+        without conversation history) but not its singleflight: waiting on
+        another request would hold back the first token, so concurrent
+        identical streams each run retrieval and generation.
+        """
+        conversation_history, key, relevant_chunks = self._prepare_query(
+            query, conversation_id, top_k, min_score
+        )
+        if not conversation_history:
+            with self._inflight_lock:
+                cached = self._response_cache.get(key)
+            if cached is not None:
+                logger.info(f"Response cache hit: {query}")
+                yield {'type': 'token', 'content': cached['response']}
+                yield {'type': 'done', **cached, 'query': query}
+                return
+        
+        if relevant_chunks is None:
+            relevant_chunks = self._retrieve(query, top_k, min_score)
+        
+        if relevant_chunks:
+            parts = []
+            for delta in self.response_gen.generate_response_stream(
+                query,
+                relevant_chunks,
+                conversation_history
+            ):
+                parts.append(delta)
+                yield {'type': 'token', 'content': delta}
+            response = self.response_gen.clean_response_format(''.join(parts))
+        else:
+            logger.warning("No relevant chunks found, using fallback response")
+            response = self.response_gen.generate_fallback_response(query)
+            yield {'type': 'token', 'content': response}
+        
+        result = self._build_result(query, response, relevant_chunks)
+        if not conversation_history:
+            with self._inflight_lock:
+                self._response_cache[key] = result
+        
+        yield {'type': 'done', **result}
+    
     def interactive_mode(self):
         """Run interactive chat mode"""
         logger.info("FIRST AID ASSISTANT")
@@ -260,7 +647,7 @@ class FirstAidRAGAssistant:
         logger.info("  'help' - Show examples")
         logger.info("  'new' - Start new conversation")
         
-        conversation_id = f"conv_{int(datetime.utcnow().timestamp())}"
+        conversation_id = f"conv_{time.time_ns()}"
         logger.info(f"Conversation ID: {conversation_id}")
         
         while True:
@@ -279,20 +666,26 @@ class FirstAidRAGAssistant:
                     continue
                 
                 if query.lower() == 'new':
-                    conversation_id = f"conv_{int(datetime.utcnow().timestamp())}"
+                    conversation_id = f"conv_{time.time_ns()}"
                     logger.info(f"New conversation: {conversation_id}")
                     continue
                 
-                # Answer query
-                result = self.answer_query(
-                    query,
-                    conversation_id=conversation_id,
-                    verbose=False
-                )
-                
-                # Display response
+                # Answer query, printing each cleaned line as it is generated
                 print("\n" + "-" * 70)
-                print(result['response'])
+                result = {}
+                
+                def tokens():
+                    for event in self.answer_query_stream(
+                        query,
+                        conversation_id=conversation_id
+                    ):
+                        if event['type'] == 'token':
+                            yield event['content']
+                        else:
+                            result.update(event)
+                
+                for line in self.response_gen.clean_response_lines(tokens()):
+                    print(line, flush=True)
                 print("\n" + "-" * 70)
                 print(f"Confidence: {result['confidence']} | Relevance: {result.get('avg_relevance', 0):.3f}")
                 
@@ -318,6 +711,25 @@ class FirstAidRAGAssistant:
             print(f"  {i}. {ex}")
 
 
+_assistant: Optional[FirstAidRAGAssistant] = None
+_assistant_lock = threading.Lock()
+
+
+def get_assistant() -> FirstAidRAGAssistant:
+    """
+    Return the process-wide assistant, creating it on first use
+    
+    The embedding model (~420MB) is loaded and warmed once per process;
+    every later caller shares it and the Pinecone/Mongo/Groq clients.
+    """
+    global _assistant
+    if _assistant is None:
+        with _assistant_lock:
+            if _assistant is None:
+                _assistant = FirstAidRAGAssistant()
+    return _assistant
+
+
 def main():
     """Main execution"""
     import argparse
@@ -330,7 +742,7 @@ def main():
     args = parser.parse_args()
     
     try:
-        assistant = FirstAidRAGAssistant()
+        assistant = get_assistant()
         
         if args.interactive:
             assistant.interactive_mode()
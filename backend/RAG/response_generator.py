@@ -4,11 +4,132 @@ Response generation using Groq LLM
 
 import re
 import logging
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+import httpx
 from groq import Groq
 
+import ahocorasick
+
 logger = logging.getLogger(__name__)
 
+# Markdown cleanup patterns, compiled once
+_RE_HEADING = re.compile(r'^\s*#{1,6}\s*', re.MULTILINE)
+_RE_BOLD = re.compile(r'\*{1,2}(.+?)\*{1,2}', re.DOTALL)
+_RE_CODE = re.compile(r'`(.+?)`', re.DOTALL)
+_RE_BULLET = re.compile(r'(?m)^[\s]*[-\*\u2022]\s+')
+_RE_BLANKLINES = re.compile(r'\n{3,}')
+
+# Prompt templates, bound once
+_CHUNK_FMT = "Source {i} ({source}):\n{text}".format
+_USER_FMT = (
+    "Based on the following authoritative first aid information, answer this question:\n\n"
+    "Question: {query}\n\n"
+    "Relevant Information:\n{context}\n\n"
+    "Provide clear, actionable first aid guidance following the response format."
+).format
+
+# Caps on context text per chunk and in total; prompt length drives Groq latency
+_MAX_CHUNK_CHARS = 1500
+_MAX_CONTEXT_CHARS = 6000
+
+# Completion budget; a single near-exact match needs a shorter answer
+_MAX_TOKENS = 2048
+_MAX_TOKENS_FOCUSED = 1024
+_FOCUSED_MIN_SCORE = 0.9
+
+# Symptom-specific guidance for queries with no retrieved context
+_SYMPTOM_GUIDANCE = {
+    "nausea": (
+        "Possible causes: food poisoning, viral infection, dehydration, motion sickness.\n\n"
+        "Relief Steps:\n"
+        "- Sit or lie down in a comfortable position.\n"
+        "- Sip water slowly or try ginger tea.\n"
+        "- Avoid solid foods until nausea passes.\n"
+        "- Get fresh air if possible.\n\n"
+        "When to Seek Medical Help:\n"
+        "- Vomiting lasts more than 24 hours or you can't keep fluids down.\n"
+        "- There's blood in vomit or severe stomach pain."
+    ),
+    "headache": (
+        "Possible causes: tension headache, dehydration, migraine, stress, or heat.\n\n"
+        "Relief Steps:\n"
+        "- Rest in a quiet, dark room.\n"
+        "- Drink water - dehydration can worsen headaches.\n"
+        "- Apply a cold compress to your forehead.\n\n"
+        "When to Seek Medical Help:\n"
+        "- The headache is sudden and severe.\n"
+        "- Vision changes, confusion, or vomiting occur."
+    ),
+    "dizziness": (
+        "Possible causes: dehydration, low blood sugar, fatigue, or fainting onset.\n\n"
+        "What to Do:\n"
+        "- Sit or lie down immediately.\n"
+        "- Drink water or an electrolyte solution.\n"
+        "- Eat something light if you haven't eaten recently.\n\n"
+        "When to Seek Medical Help:\n"
+        "- Dizziness lasts long or occurs with chest pain or shortness of breath."
+    ),
+}
+
+# Complete fallback texts, assembled once at import
+_FALLBACK_RESPONSES = {
+    keyword: (
+        f"Based on your symptoms, this may indicate {keyword.title()}.\n\n{guidance}\n\n"
+        "Additional Notes:\nThis is general first aid guidance. If symptoms worsen or "
+        "you're unsure, seek professional medical advice."
+    )
+    for keyword, guidance in _SYMPTOM_GUIDANCE.items()
+}
+
+# Single-pass keyword match; values carry table position so the first
+# keyword in table order wins, as with the sequential scan
+_FALLBACK_AC = ahocorasick.Automaton()
+for _idx, _keyword in enumerate(_FALLBACK_RESPONSES):
+    _FALLBACK_AC.add_word(_keyword, (_idx, _keyword))
+_FALLBACK_AC.make_automaton()
+
+# Used when no symptom keyword matches; filled with the user's query
+_GENERIC_FALLBACK = (
+    "I couldn't find specific information for: \"{query}\".\n\n"
+    "General First Aid Steps:\n"
+    "1. Ensure safety and check responsiveness.\n"
+    "2. Call emergency services if pain, bleeding, or confusion is severe.\n"
+    "3. Provide rest, hydration, and reassurance.\n"
+    "4. Monitor symptoms and avoid unnecessary movement.\n\n"
+    "Additional Notes:\n"
+    "If symptoms worsen or persist, consult a doctor immediately."
+).format
+
+
+@lru_cache(maxsize=2048)
+def _match_fallback(query_lower: str) -> Optional[str]:
+    """Symptom-specific fallback for a lowercased query, or None"""
+    matches = [hit for _, hit in _FALLBACK_AC.iter(query_lower)]
+    if not matches:
+        return None
+    _, keyword = min(matches)
+    return _FALLBACK_RESPONSES[keyword]
+
+
+@lru_cache(maxsize=1)
+def _get_http_client() -> httpx.Client:
+    """Process-wide keep-alive HTTP/2 pool so Groq calls skip TCP/TLS setup"""
+    return httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=50)
+    )
+
+
+def _split_lines(deltas: Iterable[str]) -> Iterator[str]:
+    """Reassemble streamed fragments into lines, yielding each once complete"""
+    pending = ''
+    for delta in deltas:
+        pending += delta
+        *complete, pending = pending.split('\n')
+        yield from complete
+    yield pending
+
 
 class ResponseGenerator:
     """Generate responses using Groq LLM"""
@@ -21,7 +142,7 @@ class ResponseGenerator:
             api_key: Groq API key
             model: Model identifier
         """
-        self.client = Groq(api_key=api_key)
+        self.client = Groq(api_key=api_key, http_client=_get_http_client())
         self.model = model
         
         self.system_prompt = """You are an expert first aid assistant with access to authoritative medical sources. 
@@ -71,45 +192,76 @@ Additional Notes
         if not text:
             return text
 
+        # Each pass is skipped when its marker cannot occur in the text
+
         # Remove markdown headings
-        text = re.sub(r'^\s*#{1,6}\s*', '', text, flags=re.MULTILINE)
+        if '#' in text:
+            text = _RE_HEADING.sub('', text)
 
         # Remove bold/italic markup
-        text = re.sub(r'\*{1,2}(.+?)\*{1,2}', r'\1', text, flags=re.DOTALL)
+        if '*' in text:
+            text = _RE_BOLD.sub(r'\1', text)
 
         # Remove inline code
-        text = re.sub(r'`(.+?)`', r'\1', text, flags=re.DOTALL)
+        if '`' in text:
+            text = _RE_CODE.sub(r'\1', text)
 
         # Normalize bullet characters
-        text = re.sub(r'(?m)^[\s]*[-\*\u2022]\s+', '- ', text)
+        text = _RE_BULLET.sub('- ', text)
 
         # Collapse excessive newlines
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        if '\n\n\n' in text:
+            text = _RE_BLANKLINES.sub('\n\n', text)
 
         return text.strip()
     
-    def generate_response(
-        self,
-        query: str,
-        context_chunks: List[Dict[str, Any]],
-        conversation_history: List[Dict[str, str]] = None
-    ) -> str:
+    def clean_response_lines(self, deltas: Iterable[str]) -> Iterator[str]:
         """
-        Generate response using Groq LLM
+        Clean a streamed response line by line as each line completes
+        
+        Applies clean_response_format to every line, collapses runs of blank
+        lines to one and drops leading/trailing blank lines, so streamed
+        output can be printed without raw markup.
         
         Args:
-            query: User query
-            context_chunks: Retrieved relevant chunks
-            conversation_history: Optional conversation history
+            deltas: Response fragments in arrival order
             
-        Returns:
-            Generated response
+        Yields:
+            Cleaned lines, without trailing newlines
         """
+        started = gap = False
+        for raw in _split_lines(deltas):
+            line = self.clean_response_format(raw)
+            if not line:
+                gap = started
+                continue
+            if gap:
+                yield ''
+                gap = False
+            started = True
+            yield line
+    
+    def _build_messages(
+        self,
+        query: str,
+        context_chunks: List[Dict[str, Any]],
+        conversation_history: List[Dict[str, str]] = None
+    ) -> List[Dict[str, str]]:
+        """Build the chat messages for a query and its retrieved context"""
         # Build context from chunks
-        context_text = "\n\n---\n\n".join([
-            f"Source {i+1} ({chunk['metadata'].get('source', 'Unknown')}):\n{chunk['text']}"
-            for i, chunk in enumerate(context_chunks[:5])
-        ])
+        parts = []
+        used = 0
+        for i, chunk in enumerate(context_chunks[:5]):
+            text = chunk['text'][:_MAX_CHUNK_CHARS]
+            if used + len(text) > _MAX_CONTEXT_CHARS:
+                break
+            parts.append(_CHUNK_FMT(
+                i=i + 1,
+                source=chunk['metadata'].get('source', 'Unknown'),
+                text=text
+            ))
+            used += len(text)
+        context_text = "\n\n---\n\n".join(parts)
         
         # Build messages
         messages = [{"role": "system", "content": self.system_prompt}]
@@ -119,16 +271,36 @@ Additional Notes
             messages.extend(conversation_history[-4:])  # Last 2 exchanges
         
         # Add current query with context
-        user_message = f"""Based on the following authoritative first aid information, answer this question:
-
-Question: {query}
-
-Relevant Information:
-{context_text}
-
-Provide clear, actionable first aid guidance following the response format."""
+        user_message = _USER_FMT(query=query, context=context_text)
 
         messages.append({"role": "user", "content": user_message})
+        return messages
+    
+    @staticmethod
+    def _max_tokens(context_chunks: List[Dict[str, Any]]) -> int:
+        """Completion budget for a request, by how focused its context is"""
+        if context_chunks and context_chunks[0].get('score', 0.0) > _FOCUSED_MIN_SCORE:
+            return _MAX_TOKENS_FOCUSED
+        return _MAX_TOKENS
+    
+    def generate_response(
+        self,
+        query: str,
+        context_chunks: List[Dict[str, Any]],
+        conversation_history: List[Dict[str, str]] = None
+    ) -> str:
+        """
+        Generate response using Groq LLM
+        
+        Args:
+            query: User query
+            context_chunks: Retrieved relevant chunks
+            conversation_history: Optional conversation history
+            
+        Returns:
+            Generated response
+        """
+        messages = self._build_messages(query, context_chunks, conversation_history)
         
         # Generate response
         try:
@@ -136,7 +308,7 @@ Provide clear, actionable first aid guidance following the response format."""
                 model=self.model,
                 messages=messages,
                 temperature=0.3,
-                max_tokens=2048
+                max_tokens=self._max_tokens(context_chunks)
             )
             
             response = completion.choices[0].message.content
@@ -146,6 +318,46 @@ Provide clear, actionable first aid guidance following the response format."""
             logger.error(f"Error generating response: {e}")
             raise
     
+    def generate_response_stream(
+        self,
+        query: str,
+        context_chunks: List[Dict[str, Any]],
+        conversation_history: List[Dict[str, str]] = None
+    ) -> Iterator[str]:
+        """
+        Stream the Groq completion as it is generated
+        
+        Yields raw text deltas; run clean_response_format on the joined text
+        once the stream ends.
+        
+        Args:
+            query: User query
+            context_chunks: Retrieved relevant chunks
+            conversation_history: Optional conversation history
+            
+        Yields:
+            Response text fragments
+        """
+        messages = self._build_messages(query, context_chunks, conversation_history)
+        
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=self._max_tokens(context_chunks),
+                stream=True
+            )
+            
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+            
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            raise
+    
     def generate_fallback_response(self, query: str) -> str:
         """
         Generate fallback response when no relevant chunks found
@@ -156,55 +368,10 @@ Provide clear, actionable first aid guidance following the response format."""
         Returns:
             Fallback response
         """
-        # Detect context from keywords
-        query_lower = query.lower()
-        
-        responses = {
-            "nausea": (
-                "Possible causes: food poisoning, viral infection, dehydration, motion sickness.\n\n"
-                "Relief Steps:\n"
-                "- Sit or lie down in a comfortable position.\n"
-                "- Sip water slowly or try ginger tea.\n"
-                "- Avoid solid foods until nausea passes.\n"
-                "- Get fresh air if possible.\n\n"
-                "When to Seek Medical Help:\n"
-                "- Vomiting lasts more than 24 hours or you can't keep fluids down.\n"
-                "- There's blood in vomit or severe stomach pain."
-            ),
-            "headache": (
-                "Possible causes: tension headache, dehydration, migraine, stress, or heat.\n\n"
-                "Relief Steps:\n"
-                "- Rest in a quiet, dark room.\n"
-                "- Drink water - dehydration can worsen headaches.\n"
-                "- Apply a cold compress to your forehead.\n\n"
-                "When to Seek Medical Help:\n"
-                "- The headache is sudden and severe.\n"
-                "- Vision changes, confusion, or vomiting occur."
-            ),
-            "dizziness": (
-                "Possible causes: dehydration, low blood sugar, fatigue, or fainting onset.\n\n"
-                "What to Do:\n"
-                "- Sit or lie down immediately.\n"
-                "- Drink water or an electrolyte solution.\n"
-                "- Eat something light if you haven't eaten recently.\n\n"
-                "When to Seek Medical Help:\n"
-                "- Dizziness lasts long or occurs with chest pain or shortness of breath."
-            ),
-        }
-        
-        # Try to match a response
-        for keyword, response in responses.items():
-            if keyword in query_lower:
-                return f"Based on your symptoms, this may indicate {keyword.title()}.\n\n{response}\n\nAdditional Notes:\nThis is general first aid guidance. If symptoms worsen or you're unsure, seek professional medical advice."
+        # Detect context from keywords (memoized per normalized query)
+        response = _match_fallback(query.strip().lower())
+        if response is not None:
+            return response
         
         # Generic fallback
-        return (
-            f"I couldn't find specific information for: \"{query}\".\n\n"
-            "General First Aid Steps:\n"
-            "1. Ensure safety and check responsiveness.\n"
-            "2. Call emergency services if pain, bleeding, or confusion is severe.\n"
-            "3. Provide rest, hydration, and reassurance.\n"
-            "4. Monitor symptoms and avoid unnecessary movement.\n\n"
-            "Additional Notes:\n"
-            "If symptoms worsen or persist, consult a doctor immediately."
-        )
+        return _GENERIC_FALLBACK(query=query)
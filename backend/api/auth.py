@@ -1,11 +1,16 @@
 import logging
+import threading
+import time
 import bcrypt
 from datetime import datetime, timedelta
 from typing import Optional
 
+from cachetools import TTLCache
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+import jwt
+from jwt import PyJWTError
 from pydantic import BaseModel
 from pymongo.collection import Collection
 
@@ -15,19 +20,38 @@ logger = setup_logger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
 
+# bcrypt cost factor; each step doubles hashing time. Existing hashes keep the
+# cost they were created with, so this only affects new passwords
+BCRYPT_ROUNDS = 10
+
+# token -> {'user': user document, 'exp': token expiry (epoch seconds)}.
+# Skips the signature check and user lookup for repeat requests; the short TTL
+# bounds how long a changed or deleted user can stay cached
+_TOKEN_CACHE = TTLCache(maxsize=10_000, ttl=60)
+_TOKEN_CACHE_LOCK = threading.Lock()
+
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    user_id: Optional[str] = None
+
+
+# Profile fields handed to endpoints; never load the password hash per request
+USER_PROJECTION = {
+    "_id": 0, "user_id": 1, "username": 1,
+    "email": 1, "full_name": 1, "created_at": 1
+}
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    password_bytes = plain_password[:72].encode('utf-8')
+    # bcrypt only reads the first 72 bytes
+    password_bytes = plain_password.encode('utf-8')[:72]
     return bcrypt.checkpw(password_bytes, hashed_password.encode('utf-8'))
 
 
 def get_password_hash(password: str) -> str:
-    password_bytes = password[:72].encode('utf-8')
-    salt = bcrypt.gensalt()
+    password_bytes = password.encode('utf-8')[:72]
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     return bcrypt.hashpw(password_bytes, salt).decode('utf-8')
 
 
@@ -38,12 +62,9 @@ def create_access_token(
     expires_delta: Optional[timedelta] = None,
     default_expire_minutes: int = 30
 ) -> str:
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=default_expire_minutes)
-    to_encode.update({"exp": expire})
+    if not expires_delta:
+        expires_delta = timedelta(minutes=default_expire_minutes)
+    to_encode = {**data, "exp": datetime.utcnow() + expires_delta}
     return jwt.encode(to_encode, secret_key, algorithm=algorithm)
 
 
@@ -53,12 +74,46 @@ def create_refresh_token(
     algorithm: str,
     expire_days: int = 7
 ) -> str:
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(days=expire_days)
-    to_encode.update({"exp": expire})
+    to_encode = {**data, "exp": datetime.utcnow() + timedelta(days=expire_days)}
     return jwt.encode(to_encode, secret_key, algorithm=algorithm)
 
 
+def _get_cached_user(token: str) -> Optional[dict]:
+    with _TOKEN_CACHE_LOCK:
+        entry = _TOKEN_CACHE.get(token)
+    if entry is not None and entry['exp'] > time.time():
+        return entry['user']
+    return None
+
+
+def _cache_user(token: str, payload: dict, user: dict) -> None:
+    exp = payload.get("exp")
+    if exp is None:
+        return
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE[token] = {'user': user, 'exp': exp}
+
+
+def _user_from_claims(token_data: TokenData) -> Optional[dict]:
+    """
+    Build the request user from the token alone
+
+    Tokens carrying a "uid" claim identify the user without a database
+    lookup; older tokens return None and fall back to Mongo.
+    """
+    if token_data.user_id is None:
+        return None
+    return {"user_id": token_data.user_id, "username": token_data.username}
+
+
+def invalidate_token(token: Optional[str]) -> None:
+    """Drop a token from the auth cache, e.g. on logout"""
+    if token is None:
+        return
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE.pop(token, None)
+
+
 async def get_current_user_optional(
     token: Optional[str],
     users_collection: Collection,
@@ -67,15 +122,24 @@ async def get_current_user_optional(
 ):
     if token is None:
         return None
+    cached = _get_cached_user(token)
+    if cached is not None:
+        return cached
     try:
         payload = jwt.decode(token, secret_key, algorithms=[algorithm])
         username: str = payload.get("sub")
         if username is None:
             return None
-    except JWTError as e:
-        logger.debug(f"Token validation failed: {str(e)}")
+        token_data = TokenData(username=username, user_id=payload.get("uid"))
+    except PyJWTError as e:
+        logger.debug("Token validation failed: %s", e)
         return None
-    return users_collection.find_one({"username": username})
+    user = _user_from_claims(token_data) or users_collection.find_one(
+        {"username": username}, USER_PROJECTION
+    )
+    if user is not None:
+        _cache_user(token, payload, user)
+    return user
 
 
 async def get_current_user(
@@ -91,17 +155,23 @@ async def get_current_user(
     )
     if token is None:
         raise credentials_exception
+    cached = _get_cached_user(token)
+    if cached is not None:
+        return cached
     try:
         payload = jwt.decode(token, secret_key, algorithms=[algorithm])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError as e:
-        logger.warning(f"JWT validation error: {str(e)}")
+        token_data = TokenData(username=username, user_id=payload.get("uid"))
+    except PyJWTError as e:
+        logger.warning("JWT validation error: %s", e)
         raise credentials_exception
-    user = users_collection.find_one({"username": token_data.username})
+    user = _user_from_claims(token_data) or users_collection.find_one(
+        {"username": token_data.username}, USER_PROJECTION
+    )
     if user is None:
-        logger.warning(f"User not found: {token_data.username}")
+        logger.warning("User not found: %s", token_data.username)
         raise credentials_exception
+    _cache_user(token, payload, user)
     return user
\ No newline at end of file
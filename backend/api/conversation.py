@@ -1,134 +1,189 @@
 """
 Conversation management utilities for First Aid Assistant API
 """
+import asyncio
 import logging
 from datetime import datetime
-from pymongo.collection import Collection
+from typing import List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
 
 from utils.logger_config import setup_logger
 
 logger = setup_logger(__name__)
 
 
-def manage_conversation_limit(
-    user_id: str,
-    conversations_collection: Collection,
-    chat_history_collection: Collection,
-    max_conversations: int = 10
-) -> None:
+class BufferedInserter:
     """
-    Ensure user has at most max_conversations conversations.
-    Delete oldest conversations if limit exceeded.
+    Coalesce inserts into one collection across requests
     
-    Args:
-        user_id: User identifier
-        conversations_collection: MongoDB conversations collection
-        chat_history_collection: MongoDB chat history collection
-        max_conversations: Maximum number of conversations to keep
+    Documents are queued and written by a background task with a single
+    unordered insert_many every flush_interval seconds, or as soon as
+    max_batch documents are waiting. start() must be called from the
+    running event loop.
     """
-    conv_count = conversations_collection.count_documents({"user_id": user_id})
     
-    if conv_count >= max_conversations:
-        to_delete_count = conv_count - max_conversations + 1
-        
-        oldest_convs = list(
-            conversations_collection.find({"user_id": user_id})
-            .sort("created_at", 1)
-            .limit(to_delete_count)
-        )
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        flush_interval: float = 0.2,
+        max_batch: int = 50
+    ):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
         
-        for conv in oldest_convs:
-            conv_id = conv['conversation_id']
-            
-            # Delete conversation
-            conversations_collection.delete_one({"conversation_id": conv_id})
-            
-            # Delete associated chat history
-            chat_history_collection.delete_many({"conversation_id": conv_id})
-            
-            logger.info(
-                f"Deleted old conversation for user {user_id}: {conv_id}"
+        self._buffer: List[dict] = []
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+    
+    def add(self, documents: List[dict]) -> None:
+        self._buffer.extend(documents)
+        if len(self._buffer) >= self.max_batch:
+            self._wakeup.set()
+    
+    async def flush(self) -> None:
+        batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+        except Exception as e:
+            logger.error(
+                f"Failed to write {len(batch)} buffered documents: {str(e)}",
+                exc_info=True
             )
+    
+    async def close(self) -> None:
+        """Stop the writer task and write whatever is still queued"""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+        await self.flush()
+    
+    async def _run(self) -> None:
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
 
 
-def create_conversation(
-    conversation_id: str,
+async def manage_conversation_limit(
     user_id: str,
-    query: str,
-    conversations_collection: Collection,
-    chat_history_collection: Collection,
-    max_conversations: int = 10
+    conversations_collection: AsyncIOMotorCollection,
+    chat_history_collection: AsyncIOMotorCollection,
+    max_conversations: int = 10,
+    reserve: int = 1
 ) -> None:
     """
-    Create a new conversation
+    Ensure user has at most max_conversations conversations.
+    Delete oldest conversations if limit exceeded.
     
     Args:
-        conversation_id: Unique conversation identifier
         user_id: User identifier
-        query: Initial query text
         conversations_collection: MongoDB conversations collection
         chat_history_collection: MongoDB chat history collection
-        max_conversations: Maximum conversations to keep per user
+        max_conversations: Maximum number of conversations to keep
+        reserve: Slots to leave free for conversations about to be created
     """
-    manage_conversation_limit(
-        user_id,
-        conversations_collection,
-        chat_history_collection,
-        max_conversations
+    # Newest first, skipping the ones to keep.
+    # A single indexed query on (user_id, created_at) instead of count + find
+    oldest_convs = await (
+        conversations_collection.find(
+            {"user_id": user_id},
+            {"conversation_id": 1, "_id": 0}
+        )
+        .sort("created_at", -1)
+        .skip(max(max_conversations - reserve, 0))
+        .to_list(None)
     )
+    conv_ids = [conv['conversation_id'] for conv in oldest_convs]
+    if not conv_ids:
+        return
     
-    current_timestamp = datetime.utcnow().isoformat()
-    title = query[:60] + "..." if len(query) > 60 else query
-    
-    conversations_collection.insert_one({
-        "conversation_id": conversation_id,
-        "user_id": user_id,
-        "title": title,
-        "message_count": 2,
-        "last_query": query,
-        "created_at": current_timestamp,
-        "updated_at": current_timestamp
-    })
+    # Delete conversations and their chat history in one command each
+    await conversations_collection.delete_many({"conversation_id": {"$in": conv_ids}})
+    await chat_history_collection.delete_many({"conversation_id": {"$in": conv_ids}})
     
-    logger.info(f"Created conversation {conversation_id} for user {user_id}")
+    logger.info(
+        f"Deleted {len(conv_ids)} old conversation(s) for user {user_id}: {conv_ids}"
+    )
 
 
-def update_conversation(
+async def upsert_conversation(
     conversation_id: str,
+    user_id: str,
     query: str,
-    conversations_collection: Collection
+    conversations_collection: AsyncIOMotorCollection,
+    chat_history_collection: AsyncIOMotorCollection,
+    max_conversations: int = 10
 ) -> None:
     """
-    Update an existing conversation
+    Create the conversation if it does not exist, otherwise update it
+    
+    One upsert replaces the existence check followed by an insert or
+    update; the per-user limit is only enforced when a conversation
+    was actually created.
     
     Args:
         conversation_id: Conversation identifier
+        user_id: User identifier
         query: Latest query text
         conversations_collection: MongoDB conversations collection
+        chat_history_collection: MongoDB chat history collection
+        max_conversations: Maximum conversations to keep per user
     """
-    current_timestamp = datetime.utcnow().isoformat()
+    current_timestamp = datetime.utcnow()
+    title = query[:60] + "..." if len(query) > 60 else query
     
-    conversations_collection.update_one(
+    result = await conversations_collection.update_one(
         {"conversation_id": conversation_id},
         {
             "$set": {
                 "last_query": query,
                 "updated_at": current_timestamp
             },
-            "$inc": {"message_count": 2}
-        }
+            "$inc": {"message_count": 2},
+            "$setOnInsert": {
+                "user_id": user_id,
+                "title": title,
+                "created_at": current_timestamp
+            }
+        },
+        upsert=True
     )
     
-    logger.debug(f"Updated conversation {conversation_id}")
+    if result.upserted_id is None:
+        logger.debug(f"Updated conversation {conversation_id}")
+        return
+    
+    logger.info(f"Created conversation {conversation_id} for user {user_id}")
+    # The new conversation is already stored, so no slot needs reserving
+    await manage_conversation_limit(
+        user_id,
+        conversations_collection,
+        chat_history_collection,
+        max_conversations,
+        reserve=0
+    )
 
 
-def save_chat_messages(
+async def save_chat_messages(
     conversation_id: str,
     query: str,
     response: str,
     sources: list,
     confidence_score: float,
-    chat_history_collection: Collection
+    chat_history_collection: AsyncIOMotorCollection,
+    history_writer: Optional[BufferedInserter] = None
 ) -> None:
     """
     Save user query and assistant response to chat history
@@ -140,10 +195,12 @@ def save_chat_messages(
         sources: Source documents
         confidence_score: Confidence percentage
         chat_history_collection: MongoDB chat history collection
+        history_writer: Optional buffered writer; messages are queued on it
+            instead of inserted immediately
     """
-    current_timestamp = datetime.utcnow().isoformat()
+    current_timestamp = datetime.utcnow()
     
-    chat_history_collection.insert_many([
+    messages = [
         {
             "conversation_id": conversation_id,
             "role": "user",
@@ -158,6 +215,66 @@ def save_chat_messages(
             "confidence_score": confidence_score,
             "timestamp": current_timestamp
         }
-    ])
+    ]
     
-    logger.debug(f"Saved messages to conversation {conversation_id}")
\ No newline at end of file
+    if history_writer is not None:
+        history_writer.add(messages)
+    else:
+        await chat_history_collection.insert_many(messages)
+    
+    logger.debug(f"Saved messages to conversation {conversation_id}")
+
+
+async def record_exchange(
+    conversation_id: str,
+    user_id: str,
+    query: str,
+    response: str,
+    sources: list,
+    confidence_score: float,
+    conversations_collection: AsyncIOMotorCollection,
+    chat_history_collection: AsyncIOMotorCollection,
+    max_conversations: int = 10,
+    history_writer: Optional[BufferedInserter] = None
+) -> None:
+    """
+    Create or update the conversation and save the query/response pair
+
+    Meant to run after the response is sent, so failures are logged rather
+    than raised.
+
+    Args:
+        conversation_id: Conversation identifier
+        user_id: User identifier
+        query: User query
+        response: Assistant response
+        sources: Source documents
+        confidence_score: Confidence percentage
+        conversations_collection: MongoDB conversations collection
+        chat_history_collection: MongoDB chat history collection
+        max_conversations: Maximum conversations to keep per user
+        history_writer: Optional buffered writer for the chat messages
+    """
+    try:
+        await upsert_conversation(
+            conversation_id,
+            user_id,
+            query,
+            conversations_collection,
+            chat_history_collection,
+            max_conversations
+        )
+        await save_chat_messages(
+            conversation_id,
+            query,
+            response,
+            sources,
+            confidence_score,
+            chat_history_collection,
+            history_writer
+        )
+    except Exception as e:
+        logger.error(
+            f"Failed to record exchange for conversation {conversation_id}: {str(e)}",
+            exc_info=True
+        )
@@ -3,6 +3,7 @@ Quick status check for First Aid RAG System
 """
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -43,33 +44,45 @@ for filename in data_files:
 if not phase1_complete:
     print("  [!] No data files found - need to run Phase 1 data collection")
 
-# Check Phase 2 - Pinecone
+def check_pinecone():
+    """Probe Pinecone; returns (report lines, has vectors)"""
+    try:
+        from pinecone import Pinecone
+        pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
+        index = pc.Index("first-aid-assistant")
+        stats = index.describe_index_stats()
+        return [f"  ✓ Pinecone vectors: {stats.total_vector_count}"], stats.total_vector_count > 0
+    except Exception as e:
+        return [f"  ✗ Pinecone: Error - {str(e)[:50]}"], False
+
+
+def check_mongo():
+    """Probe MongoDB; returns (report lines, has chunks)"""
+    try:
+        from pymongo import MongoClient
+        client = MongoClient(os.getenv('MONGODB_URI'), serverSelectionTimeoutMS=5000)
+        client.server_info()
+        db = client['first_aid_db']
+        scenario_count = db.scenarios.count_documents({})
+        chunk_count = db.chunks.count_documents({})
+        return [
+            f"  ✓ MongoDB scenarios: {scenario_count}",
+            f"  ✓ MongoDB chunks: {chunk_count}"
+        ], chunk_count > 0
+    except Exception as e:
+        return [f"  ✗ MongoDB: Error - {str(e)[:50]}"], False
+
+
+# Check Phase 2 - Pinecone and MongoDB, probed concurrently
 print("\nPhase 2 - Vector Database:")
-try:
-    from pinecone import Pinecone
-    pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
-    index = pc.Index("first-aid-assistant")
-    stats = index.describe_index_stats()
-    print(f"  ✓ Pinecone vectors: {stats.total_vector_count}")
-    phase2_pinecone = stats.total_vector_count > 0
-except Exception as e:
-    print(f"  ✗ Pinecone: Error - {str(e)[:50]}")
-    phase2_pinecone = False
+with ThreadPoolExecutor(max_workers=2) as ex:
+    pinecone_future = ex.submit(check_pinecone)
+    mongo_future = ex.submit(check_mongo)
+    pinecone_lines, phase2_pinecone = pinecone_future.result()
+    mongo_lines, phase2_mongodb = mongo_future.result()
 
-# Check Phase 2 - MongoDB
-try:
-    from pymongo import MongoClient
-    client = MongoClient(os.getenv('MONGODB_URI'), serverSelectionTimeoutMS=5000)
-    client.server_info()
-    db = client['first_aid_db']
-    scenario_count = db.scenarios.count_documents({})
-    chunk_count = db.chunks.count_documents({})
-    print(f"  ✓ MongoDB scenarios: {scenario_count}")
-    print(f"  ✓ MongoDB chunks: {chunk_count}")
-    phase2_mongodb = chunk_count > 0
-except Exception as e:
-    print(f"  ✗ MongoDB: Error - {str(e)[:50]}")
-    phase2_mongodb = False
+for line in pinecone_lines + mongo_lines:
+    print(line)
 
 # Summary
 print("\n" + "=" * 70)
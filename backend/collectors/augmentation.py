@@ -1,9 +1,15 @@
-import json
+import hashlib
+import os
+import threading
+import orjson
 import requests
-import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 import sys
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import List, Dict, Iterable, Iterator
 from pathlib import Path
 
 logging.basicConfig(
@@ -16,6 +22,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Scenarios larger than this (as compact JSON) plus two generated variants
+# overflow the model's default context and come back truncated
+MAX_SCENARIO_JSON_CHARS = 2000
+
+# Ollama calls failing back to back before the run is abandoned
+MAX_CONSECUTIVE_FAILURES = 10
+
+
+class OllamaUnavailableError(RuntimeError):
+    """Raised once Ollama has failed too many times in a row to keep going"""
+
+
+def _worth_augmenting(scenario: Dict, scenario_json: str) -> bool:
+    """Cheap checks for inputs whose LLM call would be wasted"""
+    if scenario.get('severity') == 'critical' or scenario.get('augmentation_type'):
+        return False
+    if not scenario.get('title') or not scenario.get('immediate_steps'):
+        return False
+    return len(scenario_json) <= MAX_SCENARIO_JSON_CHARS
+
 class ScenarioAugmentation:
     
     def __init__(self, data_dir: str = "./data", ollama_model: str = "llama3.2"):
@@ -23,10 +49,87 @@ class ScenarioAugmentation:
         self.data_dir.mkdir(exist_ok=True)
         self.ollama_model = ollama_model
         self.ollama_url = "http://localhost:11434/api/generate"
+        
+        # Keep-alive pool shared by the augmentation workers; transient
+        # connection errors and 5xx responses are retried with backoff.
+        # Read timeouts are not retried: a hung model would just hang again
+        self.session = requests.Session()
+        retry = Retry(
+            total=2,
+            read=0,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({'POST'}),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        # Generated variants by scenario hash, persisted across runs so
+        # unchanged scenarios never go back to the LLM
+        self._cache_path = self.data_dir / "aug_cache.jsonl"
+        self._cache_lock = threading.Lock()
+        self._cache = self._load_cache()
+        
+        self._consecutive_failures = 0
+        self._failures_lock = threading.Lock()
+        # Set once the breaker trips; checked by every worker before calling
+        self._ollama_down = threading.Event()
+    
+    def _load_cache(self) -> Dict[str, List[Dict]]:
+        cache = {}
+        if not self._cache_path.exists():
+            return cache
+        with open(self._cache_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = orjson.loads(line)
+                    cache[entry['key']] = entry['variants']
+                except (orjson.JSONDecodeError, KeyError):
+                    continue
+        logger.info(f"Loaded {len(cache)} cached augmentations from {self._cache_path}")
+        return cache
+    
+    def _scenario_key(self, scenario: Dict) -> str:
+        # Model is part of the key: switching models regenerates variants
+        payload = orjson.dumps([self.ollama_model, scenario], option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(payload).hexdigest()
+    
+    def _cache_put(self, key: str, variants: List[Dict]) -> None:
+        with self._cache_lock:
+            self._cache[key] = variants
+            with open(self._cache_path, 'ab') as f:
+                f.write(orjson.dumps({'key': key, 'variants': variants}, option=orjson.OPT_APPEND_NEWLINE))
+    
+    def prune_cache(self, scenarios: Iterable[Dict]) -> None:
+        """Drop cached variants whose source scenario is no longer in the input"""
+        live_keys = {self._scenario_key(s) for s in scenarios}
+        with self._cache_lock:
+            stale = [k for k in self._cache if k not in live_keys]
+            if not stale:
+                return
+            for k in stale:
+                del self._cache[k]
+            with open(self._cache_path, 'wb') as f:
+                for k, variants in self._cache.items():
+                    f.write(orjson.dumps({'key': k, 'variants': variants}, option=orjson.OPT_APPEND_NEWLINE))
+        logger.info(f"Pruned {len(stale)} stale cached augmentations")
+    
+    def _record_ollama_result(self, ok: bool) -> None:
+        with self._failures_lock:
+            self._consecutive_failures = 0 if ok else self._consecutive_failures + 1
+            failures = self._consecutive_failures
+            if failures >= MAX_CONSECUTIVE_FAILURES:
+                self._ollama_down.set()
+        if failures >= MAX_CONSECUTIVE_FAILURES:
+            raise OllamaUnavailableError(f"Ollama failed {failures} times in a row")
     
     def _ollama_(self, prompt: str) -> str:
+        if self._ollama_down.is_set():
+            raise OllamaUnavailableError("Ollama marked unavailable; skipping call")
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.ollama_url,
                 json={
                     'model': self.ollama_model,
@@ -35,73 +138,120 @@ class ScenarioAugmentation:
                     'temperature': 0.3,
                     'format': 'json'
                 },
-                timeout=90
+                timeout=(5, 30)
             )
             if response.status_code == 200:
-                return response.json().get('response', '').strip()
+                text = response.json().get('response', '').strip()
+                self._record_ollama_result(True)
+                return text
             logger.warning(f"Ollama returned status code {response.status_code}")
-            return ""
         except Exception as e:
             logger.error(f"Ollama connection error: {str(e)[:100]}")
-            return ""
+        self._record_ollama_result(False)
+        return ""
     
+    # Variant key requested from the LLM -> augmentation_type recorded on it
+    VARIANT_TYPES = (
+        ('elderly', 'age_specific_elderly'),
+        ('severe', 'severity_increased'),
+    )
+
     def augment_single_scenario(self, scenario: Dict) -> List[Dict]:
-        variations = []
-        if scenario.get('severity') == 'critical':
+        # Compact JSON (no spaces, raw UTF-8) keeps the prompt's token count down
+        scenario_json = orjson.dumps(scenario).decode('utf-8')
+        if not _worth_augmenting(scenario, scenario_json):
             return []
         
-        age_prompt = f"Adapt this medical scenario for ELDERLY patients (65+). Return ONLY JSON: {json.dumps(scenario)}"
-        response = self._ollama_(age_prompt)
-        self._process_variant(response, variations, 'age_specific_elderly', scenario)
+        key = self._scenario_key(scenario)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return [dict(v) for v in cached]
         
-        severity_prompt = f"Create a SEVERE version of this medical scenario. Return ONLY JSON: {json.dumps(scenario)}"
-        response = self._ollama_(severity_prompt)
-        self._process_variant(response, variations, 'severity_increased', scenario)
-        
-        return variations
+        # Both variants in one call: one round trip and one prefill of the scenario
+        prompt = (
+            "Create two variations of this medical scenario. Return ONLY a JSON object "
+            "with exactly two keys: \"elderly\" - the scenario adapted for ELDERLY "
+            "patients (65+), and \"severe\" - a SEVERE version of the scenario. Each "
+            f"value must use the same fields as the input: {scenario_json}"
+        )
+        response = self._ollama_(prompt)
+        variations = self._process_variants(response, scenario)
+        # Failed or empty generations are retried on the next run
+        if variations:
+            self._cache_put(key, variations)
+        return [dict(v) for v in variations]
 
-    def _process_variant(self, response, variations, aug_type, original):
+    def _process_variants(self, response: str, original: Dict) -> List[Dict]:
         """Helper to parse LLM response and log failures"""
+        variations = []
         try:
-            start = response.find('{')
-            end = response.rfind('}') + 1
-            if start >= 0 and end > start:
-                variant = json.loads(response[start:end])
-                variant['augmentation_type'] = aug_type
-                variant['base_scenario_id'] = original.get('title', 'unknown')
-                variations.append(variant)
-        except Exception:
-            logger.debug(f"Failed to parse {aug_type} variation")
+            # Requested with format=json, so the body normally parses as-is
+            data = orjson.loads(response)
+        except orjson.JSONDecodeError:
+            try:
+                start = response.find('{')
+                end = response.rfind('}') + 1
+                if start < 0 or end <= start:
+                    return variations
+                data = orjson.loads(response[start:end])
+            except Exception:
+                logger.debug("Failed to parse variations")
+                return variations
+        if not isinstance(data, dict):
+            return variations
+        
+        for key, aug_type in self.VARIANT_TYPES:
+            variant = data.get(key)
+            if not isinstance(variant, dict):
+                logger.debug(f"Failed to parse {aug_type} variation")
+                continue
+            variant['augmentation_type'] = aug_type
+            variant['base_scenario_id'] = original.get('title', 'unknown')
+            variations.append(variant)
+        return variations
 
-    def augment_scenarios(self, scenarios: List[Dict], target_count: int = None) -> List[Dict]:    
+    def iter_augmented(self, scenarios: List[Dict], target_count: int = None, concurrency: int = 8) -> Iterator[Dict]:
+        """Yield generated variants in input order as soon as each scenario finishes"""
         if target_count is None:
             target_count = len(scenarios) // 2  
             
         scenarios_to_augment = min(len(scenarios), target_count)
         
-        logger.info(f"Starting augmentation: Target {scenarios_to_augment} scenarios")
-        
-        augmented_scenarios = []
-        for idx, scenario in enumerate(scenarios[:scenarios_to_augment], 1):
-            if idx % 50 == 0:
-                logger.info(f"Progress: {idx}/{scenarios_to_augment} | Generated: {len(augmented_scenarios)}")
-            
-            try:
-                variations = self.augment_single_scenario(scenario)
-                augmented_scenarios.extend(variations)
-                time.sleep(0.3) 
-            except Exception as e:
-                logger.error(f"Error augmenting scenario {idx}: {e}")
-                continue
+        logger.info(f"Starting augmentation: Target {scenarios_to_augment} scenarios ({concurrency} concurrent)")
         
-        return augmented_scenarios
+        # Ollama calls are network/LLM-bound; the pool size caps in-flight requests
+        generated = 0
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="augment") as pool:
+            futures = [
+                pool.submit(self.augment_single_scenario, scenario)
+                for scenario in scenarios[:scenarios_to_augment]
+            ]
+            # Collect in input order so output is deterministic
+            for idx, future in enumerate(futures, 1):
+                if idx % 50 == 0:
+                    logger.info(f"Progress: {idx}/{scenarios_to_augment} | Generated: {generated}")
+                
+                try:
+                    variations = future.result()
+                except OllamaUnavailableError:
+                    # Drop the queued scenarios instead of failing them one by one
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+                except Exception as e:
+                    logger.error(f"Error augmenting scenario {idx}: {e}")
+                    continue
+                generated += len(variations)
+                yield from variations
+
+    def augment_scenarios(self, scenarios: List[Dict], target_count: int = None, concurrency: int = 8) -> List[Dict]:    
+        return list(self.iter_augmented(scenarios, target_count, concurrency))
     
     def augment_scenarios_file(self, input_file: str, output_file: str = None, target_total: int = 3000) -> str:
         input_path = self.data_dir / input_file
         logger.info(f"Loading data from {input_path}")
         
-        with open(input_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(input_path, 'rb') as f:
+            data = orjson.loads(f.read())
         
         original_scenarios = data.get('scenarios', data if isinstance(data, list) else [])
         current_count = len(original_scenarios)
@@ -113,30 +263,38 @@ class ScenarioAugmentation:
         needed = target_total - current_count
         scenarios_to_augment = min(len(original_scenarios), needed // 2)
         
-        augmented = self.augment_scenarios(original_scenarios, target_count=scenarios_to_augment)
-        combined = original_scenarios + augmented
-        final_scenarios = deduplicate_scenarios_simple(combined)
-        
         output_path = self.data_dir / (output_file or input_file)
+        tmp_path = output_path.with_name(output_path.name + '.tmp')
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump({
-                'final_count': len(final_scenarios),
-                'scenarios': final_scenarios
-            }, f, indent=2, ensure_ascii=False)
+        # Variants are deduplicated and written as they arrive rather than
+        # collected and serialised as one buffer; the temp file keeps the
+        # previous output intact if the run dies part way
+        augmented = self.iter_augmented(original_scenarios, target_count=scenarios_to_augment)
+        final_count = 0
+        with open(tmp_path, 'wb') as f:
+            f.write(b'{\n  "scenarios": [')
+            for scenario in iter_unique_scenarios(chain(original_scenarios, augmented)):
+                f.write(b',\n    ' if final_count else b'\n    ')
+                # orjson escapes newlines inside strings, so this only re-indents
+                f.write(orjson.dumps(scenario, option=orjson.OPT_INDENT_2).replace(b'\n', b'\n    '))
+                final_count += 1
+            f.write(b'\n  ],\n  "final_count": %d\n}' % final_count)
+        os.replace(tmp_path, output_path)
+        self.prune_cache(original_scenarios)
         
-        logger.info(f"Augmentation complete. Final count: {len(final_scenarios)}. Saved to {output_path}")
+        logger.info(f"Augmentation complete. Final count: {final_count}. Saved to {output_path}")
         return str(output_path)
 
-def deduplicate_scenarios_simple(scenarios: List[Dict]) -> List[Dict]:
+def iter_unique_scenarios(scenarios: Iterable[Dict]) -> Iterator[Dict]:
     seen = set()
-    unique = []
     for scenario in scenarios:
         sig = f"{scenario.get('title', '')}:{scenario.get('severity', '')}".lower()
         if sig not in seen:
             seen.add(sig)
-            unique.append(scenario)
-    return unique
+            yield scenario
+
+def deduplicate_scenarios_simple(scenarios: List[Dict]) -> List[Dict]:
+    return list(iter_unique_scenarios(scenarios))
 
 if __name__ == "__main__":
     augmentor = ScenarioAugmentation()
@@ -1,23 +1,84 @@
 import os
-import json
+import hashlib
 import re
 import logging
+import orjson
 import requests
+import threading
 import time
-from typing import List, Dict
+from cachetools import LRUCache
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Optional, Tuple
 from abc import ABC, abstractmethod
 
 logger = logging.getLogger(__name__)
 
+_CODE_FENCE_RE = re.compile(r'^```(?:json)?|```$', re.MULTILINE)
+_JSON_ARRAY_RE = re.compile(r'\[.*\]', re.DOTALL)
+
+OLLAMA_TEMPERATURE = 0.3
+# Characters of source text sent to the model per extraction call
+MAX_EXTRACT_CHARS = 4500
+# How long Ollama keeps the model (and its prompt cache) loaded between calls
+OLLAMA_KEEP_ALIVE = "30m"
+# Raw responses kept in RAM in front of the on-disk LLM cache
+LLM_MEMORY_CACHE_SIZE = 256
+
+# Identical for every extraction call and sent first, so Ollama can reuse
+# the processed prefix and only prefill the page text
+EXTRACTION_SYSTEM_PROMPT = """You are a medical first aid expert. Extract MULTIPLE first aid scenarios from the text you are given.
+
+CRITICAL RULES:
+1. Extract 3-5 scenarios if the text covers multiple topics
+2. Each scenario MUST have at least 3 immediate steps
+3. Return ONLY a JSON array.
+
+JSON Structure:
+{
+  "title": "Specific clear title",
+  "category": "Wounds|Burns|Musculoskeletal|Cardiac|Respiratory|Poisoning|Environmental|Bites/Stings|Allergic|General|Neurological|Shock",
+  "subcategory": "Specific type",
+  "severity": "minor|moderate|severe|critical",
+  "age_group": "all|child|adult|elderly",
+  "symptoms": ["symptom1", "symptom2"],
+  "immediate_steps": ["step1", "step2", "step3"],
+  "when_to_seek_help": ["condition1"],
+  "do_not": ["action1"],
+  "additional_info": "Notes"
+}"""
+_SYSTEM_MESSAGE = {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT}
+_USER_TEMPLATE = "Text to analyze:\n{text}"
+_EXTRACTION_OPTIONS = {"temperature": OLLAMA_TEMPERATURE, "num_ctx": 8192}
+# Folded into every on-disk cache key, so editing the prompt or options
+# invalidates responses produced under the old ones
+_PROMPT_FINGERPRINT = hashlib.sha256(
+    orjson.dumps([EXTRACTION_SYSTEM_PROMPT, _USER_TEMPLATE, _EXTRACTION_OPTIONS])
+).hexdigest()[:16]
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
 class BaseCollector(ABC):
     
     def __init__(self, data_dir: str = "../data", ollama_model: str = "llama3.2"):
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
         self.ollama_model = ollama_model
-        self.ollama_url = "http://localhost:11434/api/generate"
+        self.ollama_url = "http://localhost:11434/api/chat"
         self.logger = logger  
         
+        # Raw model output by hash of (model, prompt, options, text), kept on
+        # disk so re-scraped pages never go back to the LLM, with the most
+        # recently used entries also held in a bounded in-memory LRU
+        self._cache_dir = os.path.join(data_dir, "_llm_cache")
+        os.makedirs(self._cache_dir, exist_ok=True)
+        self._response_cache: LRUCache = LRUCache(maxsize=LLM_MEMORY_CACHE_SIZE)
+        # Batched extraction reads and fills the LRU from pool threads
+        self._response_cache_lock = threading.Lock()
+        
+        # Keep-alive connections to Ollama, shared by batched extraction
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        
         try:
             response = requests.get("http://localhost:11434/api/tags", timeout=5)
             if response.status_code == 200:
@@ -28,11 +89,23 @@ class BaseCollector(ABC):
                 if not any(ollama_model in name for name in model_names):
                     self.logger.warning(f"Model '{ollama_model}' not found. Installing...")
                     self.install_model(ollama_model)
+                self._warm_up_model()
             else:
                 self.logger.error("Ollama not responding. Run: ollama serve")
         except requests.exceptions.RequestException:
             self.logger.error("Ollama not available. Ensure it is installed and running.")
 
+    def _warm_up_model(self):
+        """Load the model now and keep it resident for the whole collection run"""
+        try:
+            self._session.post(
+                "http://localhost:11434/api/generate",
+                json={"model": self.ollama_model, "keep_alive": OLLAMA_KEEP_ALIVE},
+                timeout=120
+            )
+        except requests.exceptions.RequestException as e:
+            self.logger.warning(f"Failed to preload model {self.ollama_model}: {e}")
+
     def install_model(self, model_name: str):
 
         self.logger.info(f"Pulling model {model_name}... (this may take a few minutes)")
@@ -41,7 +114,7 @@ class BaseCollector(ABC):
             response = requests.post(pull_url, json={"name": model_name}, stream=True, timeout=300)
             for line in response.iter_lines():
                 if line:
-                    data = json.loads(line)
+                    data = orjson.loads(line)
                     if 'status' in data:
                         self.logger.debug(f"Pull status: {data['status']}")
             self.logger.info(f"Model {model_name} ready!")
@@ -49,6 +122,39 @@ class BaseCollector(ABC):
             self.logger.error(f"Failed to pull model: {e}")
             raise
 
+    def _cache_key(self, text: str) -> str:
+        payload = f"{self.ollama_model}|{_PROMPT_FINGERPRINT}|{text[:MAX_EXTRACT_CHARS]}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _get_cached_response(self, key: str) -> Optional[str]:
+        with self._response_cache_lock:
+            cached = self._response_cache.get(key)
+        if cached is not None:
+            return cached
+        path = os.path.join(self._cache_dir, f"{key}.json")
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                cached = orjson.loads(f.read())['response']
+        except (OSError, ValueError, KeyError):
+            return None
+        with self._response_cache_lock:
+            self._response_cache[key] = cached
+        return cached
+
+    def _put_cached_response(self, key: str, response_text: str):
+        with self._response_cache_lock:
+            self._response_cache[key] = response_text
+        path = os.path.join(self._cache_dir, f"{key}.json")
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps({'model': self.ollama_model, 'response': response_text}))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.logger.warning(f"Failed to write LLM cache entry {key}: {e}")
+
     @abstractmethod
     def collect(self) -> List[Dict]:
         pass
@@ -62,63 +168,65 @@ class BaseCollector(ABC):
         if len(text) < 200:
             return []
         
-        prompt = f"""You are a medical first aid expert. Extract MULTIPLE first aid scenarios from this text.
-
-CRITICAL RULES:
-1. Extract 3-5 scenarios if the text covers multiple topics
-2. Each scenario MUST have at least 3 immediate steps
-3. Return ONLY a JSON array.
-
-Text to analyze:
-{text[:4500]}
-
-JSON Structure:
-{{
-  "title": "Specific clear title",
-  "category": "Wounds|Burns|Musculoskeletal|Cardiac|Respiratory|Poisoning|Environmental|Bites/Stings|Allergic|General|Neurological|Shock",
-  "subcategory": "Specific type",
-  "severity": "minor|moderate|severe|critical",
-  "age_group": "all|child|adult|elderly",
-  "symptoms": ["symptom1", "symptom2"],
-  "immediate_steps": ["step1", "step2", "step3"],
-  "when_to_seek_help": ["condition1"],
-  "do_not": ["action1"],
-  "additional_info": "Notes"
-}}"""
-
+        cache_key = self._cache_key(text)
+        cached = self._get_cached_response(cache_key)
+        if cached is not None:
+            return self.clean_response(cached, source)
+        
         try:
-            response = requests.post(
+            # Serialised with orjson and sent as raw bytes rather than via json=
+            body = orjson.dumps({
+                "model": self.ollama_model,
+                "messages": [
+                    _SYSTEM_MESSAGE,
+                    {"role": "user", "content": _USER_TEMPLATE.format(text=text[:MAX_EXTRACT_CHARS])}
+                ],
+                "stream": False,
+                "format": "json",
+                "options": _EXTRACTION_OPTIONS,
+                "keep_alive": OLLAMA_KEEP_ALIVE
+            })
+            response = self._session.post(
                 self.ollama_url,
-                json={
-                    "model": self.ollama_model,
-                    "prompt": prompt,
-                    "stream": False,
-                    "format": "json",
-                    "temperature": 0.3
-                },
+                data=body,
+                headers=_JSON_HEADERS,
                 timeout=120
             )
             
             if response.status_code == 200:
-                result = response.json()
-                return self.clean_response(result.get('response', ''), source)
+                response_text = orjson.loads(response.content).get('message', {}).get('content', '')
+                scenarios = self.clean_response(response_text, source)
+                # Only cache output that parsed; failures are retried next run
+                if scenarios:
+                    self._put_cached_response(cache_key, response_text)
+                return scenarios
             return []
                 
         except Exception as e:
             self.logger.error(f"Ollama error: {e}")
             return []
 
+    def _extract_with_ollama_batch(
+        self, items: List[Tuple[str, str]], max_workers: int = 4
+    ) -> List[List[Dict]]:
+        """Run _extract_with_ollama over (text, source) pairs with several
+        requests in flight, so Ollama can batch them; results keep input order"""
+        if len(items) <= 1:
+            return [self._extract_with_ollama(text, source) for text, source in items]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(lambda item: self._extract_with_ollama(*item), items))
+
     def clean_response(self, response_text: str, source: str) -> List[Dict]:
 
         try:
 
             cleaned_text = response_text.strip()
             if cleaned_text.startswith("```"):
-                cleaned_text = re.sub(r'^```(?:json)?|```$', '', cleaned_text, flags=re.MULTILINE).strip()
+                cleaned_text = _CODE_FENCE_RE.sub('', cleaned_text).strip()
 
-            json_match = re.search(r'\[.*\]', cleaned_text, re.DOTALL)
+            json_match = _JSON_ARRAY_RE.search(cleaned_text)
             if json_match:
-                data = json.loads(json_match.group(0))
+                data = orjson.loads(json_match.group(0))
                 
                 if isinstance(data, dict):
                     data = [data]
@@ -137,7 +245,7 @@ JSON Structure:
             
             self.logger.warning(f"No valid JSON array found in response for {source}")
             
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             self.logger.error(f"Failed to parse JSON from LLM response for {source}")
         except Exception as e:
             self.logger.error(f"Error during response cleaning for {source}: {e}")
@@ -147,8 +255,8 @@ JSON Structure:
     def save_checkpoint(self, scenarios: List[Dict], filename: str):
         filepath = os.path.join(self.data_dir, filename)
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(scenarios, f, indent=2, ensure_ascii=False)
+            with open(filepath, 'wb') as f:
+                f.write(orjson.dumps(scenarios, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
             self.logger.info(f"Saved: {filename} ({len(scenarios)} scenarios)")
         except Exception as e:
             self.logger.error(f"Failed to save checkpoint {filename}: {e}")
\ No newline at end of file
@@ -60,20 +60,23 @@ class RedCrossCollector(BaseCollector):
                 logger.info(f"Processing {total_pages} pages from Red Cross PDF")
                 logger.info(f"Using Ollama model: {self.ollama_model}")
 
+                batch = []
                 for page_num in range(total_pages):
                     page = pdf.pages[page_num]
                     page_text = page.extract_text()
 
                     if not page_text or len(page_text) < 200:
                         logger.debug(f"Page {page_num + 1}: Skipping ")
-                        continue
+                    else:
+                        batch.append((page_text, f"Red Cross Manual, Page {page_num + 1}"))
 
-                    page_scenarios = self._extract_with_ollama(
-                        page_text,
-                        f"Red Cross Manual, Page {page_num + 1}"
-                    )
+                    # Pages go to Ollama ten at a time so several are in flight
+                    if (page_num + 1) % 10 != 0 and page_num + 1 < total_pages:
+                        continue
 
-                    scenarios.extend(page_scenarios)
+                    for page_scenarios in self._extract_with_ollama_batch(batch):
+                        scenarios.extend(page_scenarios)
+                    batch = []
 
                     if (page_num + 1) % 10 == 0:
                         avg_per_page = len(scenarios) / (page_num + 1)
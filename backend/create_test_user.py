@@ -4,13 +4,12 @@ Run this to create a test user in your database
 """
 import os
 from pymongo import MongoClient
-from passlib.context import CryptContext
 from datetime import datetime
 from dotenv import load_dotenv
 
-load_dotenv()
+from api.auth import get_password_hash
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+load_dotenv()
 
 def create_test_user():
     """Create a test user in the database"""
@@ -30,7 +29,7 @@ def create_test_user():
         'user_id': 'user_test_001',
         'email': 'test@example.com',
         'username': 'testuser',
-        'hashed_password': pwd_context.hash('testpass123'),
+        'hashed_password': get_password_hash('testpass123'),
         'full_name': 'Test User',
         'created_at': datetime.utcnow().isoformat(),
         'is_active': True
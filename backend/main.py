@@ -1,5 +1,8 @@
+import asyncio
+import json
 import logging
 import os
+import secrets
 import time
 import uuid
 from datetime import datetime
@@ -7,14 +10,16 @@ from typing import List, Optional
 
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Header, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr
 import certifi
+from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import MongoClient, DESCENDING
 
-from RAG.rag import FirstAidRAGAssistant
+from RAG.rag import get_assistant
 from api.auth import (
     oauth2_scheme,
     verify_password,
@@ -22,13 +27,11 @@ from api.auth import (
     create_access_token,
     create_refresh_token,
     get_current_user_optional,
-    get_current_user
-)
-from api.conversation import (
-    create_conversation,
-    update_conversation,
-    save_chat_messages
+    get_current_user,
+    invalidate_token,
+    USER_PROJECTION
 )
+from api.conversation import BufferedInserter, record_exchange
 from utils.logger_config import setup_logger, get_default_log_file
 
 load_dotenv()
@@ -44,6 +47,8 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 MAX_CONVERSATIONS_PER_USER = 10
+# Shared secret for maintenance endpoints; unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 
 class UserCreate(BaseModel):
@@ -93,8 +98,8 @@ class ConversationResponse(BaseModel):
     user_id: str
     message_count: int
     last_query: Optional[str] = None
-    created_at: str
-    updated_at: str
+    created_at: datetime
+    updated_at: datetime
 
 
 class MessageResponse(BaseModel):
@@ -102,7 +107,7 @@ class MessageResponse(BaseModel):
     content: str
     sources: Optional[List[dict]] = None
     confidence_score: Optional[float] = None
-    timestamp: str
+    timestamp: datetime
 
 
 class UpdateTitleRequest(BaseModel):
@@ -151,17 +156,43 @@ mongo_client = MongoClient(
 )
 db = mongo_client['first_aid_db']
 users_collection = db['users']
-conversations_collection = db['conversations']
-chat_history_collection = db['chat_history']
 
 users_collection.create_index("username", unique=True)
 users_collection.create_index("email", unique=True)
-conversations_collection.create_index([("user_id", 1), ("created_at", DESCENDING)])
-conversations_collection.create_index("conversation_id", unique=True)
-chat_history_collection.create_index([("conversation_id", 1), ("timestamp", 1)])
+db['conversations'].create_index([("user_id", 1), ("created_at", DESCENDING)])
+db['conversations'].create_index("conversation_id", unique=True)
+db['chat_history'].create_index([("conversation_id", 1), ("timestamp", 1)])
 
 logger.info("Database indexes created successfully")
 
+# Conversation and history traffic goes through motor so it is awaited on
+# the event loop instead of blocking a worker thread per round trip
+async_mongo_client = AsyncIOMotorClient(
+    MONGODB_URI,
+    tls=True,
+    tlsCAFile=certifi.where(),
+    serverSelectionTimeoutMS=30000,
+    connectTimeoutMS=20000,
+    socketTimeoutMS=20000,
+)
+async_db = async_mongo_client['first_aid_db']
+conversations_collection = async_db['conversations']
+chat_history_collection = async_db['chat_history']
+
+# Chat messages from all requests are written in batches
+chat_history_writer = BufferedInserter(chat_history_collection)
+
+
+@app.on_event("startup")
+async def start_chat_history_writer():
+    chat_history_writer.start()
+
+
+@app.on_event("shutdown")
+async def flush_chat_history():
+    await chat_history_writer.close()
+
+
 # =============================================================================
 # Initialize RAG Assistant
 # =============================================================================
@@ -169,7 +200,7 @@ logger.info("Database indexes created successfully")
 logger.info("Initializing First Aid RAG Assistant")
 
 try:
-    rag_assistant = FirstAidRAGAssistant()
+    rag_assistant = get_assistant()
     logger.info("RAG Assistant initialized successfully")
 except Exception as e:
     logger.error(f"Failed to initialize RAG Assistant: {e}", exc_info=True)
@@ -196,19 +227,20 @@ async def get_required_user(token: str = Depends(oauth2_scheme)):
 
 @app.post("/auth/register", response_model=Token, status_code=status.HTTP_201_CREATED)
 async def register(user: UserCreate):
-    if users_collection.find_one({"username": user.username}):
+    if users_collection.find_one({"username": user.username}, {"_id": 1}):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
-    if users_collection.find_one({"email": user.email}):
+    if users_collection.find_one({"email": user.email}, {"_id": 1}):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
 
     user_id = str(uuid.uuid4())
-    hashed_password = get_password_hash(user.password)  # truncation handled inside
+    # Hashing is CPU-bound; keep it off the event loop
+    hashed_password = await asyncio.to_thread(get_password_hash, user.password)  # truncation handled inside
 
     user_doc = {
         "user_id": user_id,
@@ -223,12 +255,12 @@ async def register(user: UserCreate):
     logger.info(f"New user registered: {user.username}")
 
     access_token = create_access_token(
-        data={"sub": user.username},
+        data={"sub": user.username, "uid": user_id},
         secret_key=SECRET_KEY,
         algorithm=ALGORITHM
     )
     refresh_token = create_refresh_token(
-        data={"sub": user.username},
+        data={"sub": user.username, "uid": user_id},
         secret_key=SECRET_KEY,
         algorithm=ALGORITHM
     )
@@ -252,11 +284,15 @@ async def register(user: UserCreate):
 @app.post("/auth/login", response_model=Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     # Search by username OR email
-    user = users_collection.find_one({"username": form_data.username})
+    login_projection = {**USER_PROJECTION, "hashed_password": 1}
+    user = users_collection.find_one({"username": form_data.username}, login_projection)
     if not user:
-        user = users_collection.find_one({"email": form_data.username})
+        user = users_collection.find_one({"email": form_data.username}, login_projection)
 
-    if not user or not verify_password(form_data.password, user["hashed_password"]):
+    password_ok = user is not None and await asyncio.to_thread(
+        verify_password, form_data.password, user["hashed_password"]
+    )
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -265,12 +301,12 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     logger.info(f"User logged in: {form_data.username}")
 
     access_token = create_access_token(
-        data={"sub": user["username"]},
+        data={"sub": user["username"], "uid": user["user_id"]},
         secret_key=SECRET_KEY,
         algorithm=ALGORITHM
     )
     refresh_token = create_refresh_token(
-        data={"sub": user["username"]},
+        data={"sub": user["username"], "uid": user["user_id"]},
         secret_key=SECRET_KEY,
         algorithm=ALGORITHM
     )
@@ -293,6 +329,18 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 
 @app.get("/auth/me", response_model=UserResponse)
 async def get_current_user_info(current_user: dict = Depends(get_required_user)):
+    # Token-only users carry just user_id/username; load the full profile here
+    if "email" not in current_user:
+        profile = users_collection.find_one(
+            {"username": current_user["username"]}, USER_PROJECTION
+        )
+        if profile is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        current_user = profile
     return UserResponse(
         user_id=current_user["user_id"],
         email=current_user["email"],
@@ -303,7 +351,8 @@ async def get_current_user_info(current_user: dict = Depends(get_required_user))
 
 
 @app.post("/auth/logout")
-async def logout():
+async def logout(token: Optional[str] = Depends(oauth2_scheme)):
+    invalidate_token(token)
     return {"message": "Logged out successfully"}
 
 
@@ -311,9 +360,27 @@ async def logout():
 # Query Endpoint
 # =============================================================================
 
+def confidence_to_percentage(confidence) -> float:
+    if isinstance(confidence, str) and '%' in confidence:
+        return float(confidence.replace('%', ''))
+    if isinstance(confidence, (int, float)):
+        return float(confidence)
+    if isinstance(confidence, str):
+        confidence_map = {
+            'high': 85.0,
+            'medium': 65.0,
+            'moderate': 65.0,
+            'low': 40.0,
+            'unknown': 0.0
+        }
+        return confidence_map.get(confidence.lower(), 0.0)
+    return 0.0
+
+
 @app.post("/api/query", response_model=QueryResponse)
 async def query(
     request: QueryRequest,
+    background_tasks: BackgroundTasks,
     current_user: Optional[dict] = Depends(get_optional_user)
 ):
     if not rag_assistant:
@@ -326,13 +393,16 @@ async def query(
 
     conversation_id = request.conversation_id
     if current_user and not conversation_id:
-        conversation_id = f"conv_{current_user['user_id']}_{int(datetime.utcnow().timestamp())}"
+        conversation_id = f"conv_{current_user['user_id']}_{time.time_ns()}"
 
     user_label = f"user {current_user['username']}" if current_user else "guest"
     logger.info(f"Processing query from {user_label}: {request.query[:50]}...")
 
     try:
-        result = rag_assistant.answer_query(
+        # Retrieval and generation block; run them off the event loop so other
+        # requests (and identical in-flight queries) proceed concurrently
+        result = await asyncio.to_thread(
+            rag_assistant.answer_query,
             query=request.query,
             conversation_id=conversation_id,
             top_k=request.top_k,
@@ -340,49 +410,22 @@ async def query(
             verbose=False
         )
 
-        confidence = result.get('confidence', 'Unknown')
-        if isinstance(confidence, str) and '%' in confidence:
-            confidence_percentage = float(confidence.replace('%', ''))
-        elif isinstance(confidence, (int, float)):
-            confidence_percentage = float(confidence)
-        elif isinstance(confidence, str):
-            confidence_map = {
-                'high': 85.0,
-                'medium': 65.0,
-                'moderate': 65.0,
-                'low': 40.0,
-                'unknown': 0.0
-            }
-            confidence_percentage = confidence_map.get(confidence.lower(), 0.0)
-        else:
-            confidence_percentage = 0.0
+        confidence_percentage = confidence_to_percentage(result.get('confidence', 'Unknown'))
 
         if current_user:
-            conversation_exists = conversations_collection.find_one({
-                "conversation_id": conversation_id
-            })
-            if not conversation_exists:
-                create_conversation(
-                    conversation_id,
-                    current_user["user_id"],
-                    request.query,
-                    conversations_collection,
-                    chat_history_collection,
-                    MAX_CONVERSATIONS_PER_USER
-                )
-            else:
-                update_conversation(
-                    conversation_id,
-                    request.query,
-                    conversations_collection
-                )
-            save_chat_messages(
+            # Persist after the response is sent; keeps Mongo writes off the hot path
+            background_tasks.add_task(
+                record_exchange,
                 conversation_id,
+                current_user["user_id"],
                 request.query,
                 result['response'],
                 result.get('sources', []),
                 confidence_percentage,
-                chat_history_collection
+                conversations_collection,
+                chat_history_collection,
+                MAX_CONVERSATIONS_PER_USER,
+                chat_history_writer
             )
 
         total_time = (time.time() - start_time) * 1000
@@ -408,6 +451,81 @@ async def query(
         )
 
 
+@app.post("/api/query/stream")
+async def query_stream(
+    request: QueryRequest,
+    background_tasks: BackgroundTasks,
+    current_user: Optional[dict] = Depends(get_optional_user)
+):
+    """Same as /api/query, streamed as newline-delimited JSON events"""
+    if not rag_assistant:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Assistant service unavailable"
+        )
+
+    conversation_id = request.conversation_id
+    if current_user and not conversation_id:
+        conversation_id = f"conv_{current_user['user_id']}_{time.time_ns()}"
+
+    user_label = f"user {current_user['username']}" if current_user else "guest"
+    logger.info(f"Streaming query from {user_label}: {request.query[:50]}...")
+
+    def event_stream():
+        start_time = time.time()
+        try:
+            for event in rag_assistant.answer_query_stream(
+                query=request.query,
+                conversation_id=conversation_id,
+                top_k=request.top_k,
+                min_score=request.min_score
+            ):
+                if event['type'] == 'done':
+                    confidence_percentage = confidence_to_percentage(event.get('confidence', 'Unknown'))
+                    event = {
+                        'type': 'done',
+                        'query': event.get('query', request.query),
+                        'response': event['response'],
+                        'sources': event.get('sources', []),
+                        'confidence_score': confidence_percentage,
+                        'chunks_found': event.get('chunks_found', 0),
+                        'avg_relevance': event.get('avg_relevance', 0.0),
+                        'performance': event.get('performance', {}),
+                        'conversation_id': conversation_id,
+                        'timestamp': datetime.utcnow().isoformat()
+                    }
+                    if current_user:
+                        # Runs once the stream has been fully sent
+                        background_tasks.add_task(
+                            record_exchange,
+                            conversation_id,
+                            current_user["user_id"],
+                            request.query,
+                            event['response'],
+                            event['sources'],
+                            confidence_percentage,
+                            conversations_collection,
+                            chat_history_collection,
+                            MAX_CONVERSATIONS_PER_USER,
+                            chat_history_writer
+                        )
+                    total_time = (time.time() - start_time) * 1000
+                    logger.info(f"Response streamed in {total_time:.0f}ms")
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            logger.error(f"Query streaming failed: {str(e)}", exc_info=True)
+            yield json.dumps({
+                'type': 'error',
+                'detail': f"Query processing failed: {str(e)}"
+            }) + "\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        background=background_tasks
+    )
+
+
 # =============================================================================
 # Conversation Endpoints
 # =============================================================================
@@ -417,10 +535,11 @@ async def get_conversations(
     limit: int = 20,
     current_user: dict = Depends(get_required_user)
 ):
-    conversations = list(
+    conversations = await (
         conversations_collection.find({"user_id": current_user["user_id"]})
         .sort("updated_at", -1)
         .limit(min(limit, MAX_CONVERSATIONS_PER_USER))
+        .to_list(None)
     )
     for conv in conversations:
         conv.pop("_id", None)
@@ -432,16 +551,17 @@ async def get_conversation(
     conversation_id: str,
     current_user: dict = Depends(get_required_user)
 ):
-    conv = conversations_collection.find_one({
+    conv = await conversations_collection.find_one({
         "conversation_id": conversation_id,
         "user_id": current_user["user_id"]
     })
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    messages = list(
+    messages = await (
         chat_history_collection.find({"conversation_id": conversation_id})
         .sort("timestamp", 1)
+        .to_list(None)
     )
     for msg in messages:
         msg.pop("_id", None)
@@ -456,17 +576,18 @@ async def get_conversation_history(
     limit: int = 50,
     current_user: dict = Depends(get_required_user)
 ):
-    conv = conversations_collection.find_one({
+    conv = await conversations_collection.find_one({
         "conversation_id": conversation_id,
         "user_id": current_user["user_id"]
     })
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    messages = list(
+    messages = await (
         chat_history_collection.find({"conversation_id": conversation_id})
         .sort("timestamp", 1)
         .limit(limit)
+        .to_list(None)
     )
     for msg in messages:
         msg.pop("_id", None)
@@ -484,7 +605,7 @@ async def update_conversation_title(
     request: UpdateTitleRequest,
     current_user: dict = Depends(get_required_user)
 ):
-    result = conversations_collection.update_one(
+    result = await conversations_collection.update_one(
         {
             "conversation_id": conversation_id,
             "user_id": current_user["user_id"]
@@ -492,7 +613,7 @@ async def update_conversation_title(
         {
             "$set": {
                 "title": request.title,
-                "updated_at": datetime.utcnow().isoformat()
+                "updated_at": datetime.utcnow()
             }
         }
     )
@@ -506,18 +627,32 @@ async def delete_conversation(
     conversation_id: str,
     current_user: dict = Depends(get_required_user)
 ):
-    result = conversations_collection.delete_one({
+    result = await conversations_collection.delete_one({
         "conversation_id": conversation_id,
         "user_id": current_user["user_id"]
     })
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    chat_history_collection.delete_many({"conversation_id": conversation_id})
+    await chat_history_collection.delete_many({"conversation_id": conversation_id})
     logger.info(f"Deleted conversation {conversation_id}")
     return {"message": "Conversation deleted successfully"}
 
 
+# =============================================================================
+# Admin Endpoints
+# =============================================================================
+
+@app.post("/api/admin/cache/clear")
+async def clear_response_cache(x_admin_token: Optional[str] = Header(None)):
+    """Drop cached answers, e.g. after the knowledge base is re-indexed"""
+    if not ADMIN_TOKEN or not secrets.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+    if rag_assistant:
+        rag_assistant.clear_response_cache()
+    return {"message": "Response cache cleared"}
+
+
 # =============================================================================
 # Health Endpoints
 # =============================================================================
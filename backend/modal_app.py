@@ -35,16 +35,20 @@ image = (
         "fastapi",
         "uvicorn[standard]",
         "python-multipart",
-        "python-jose[cryptography]",
-        "passlib[bcrypt]",
+        "PyJWT",
+        "bcrypt",
         "pydantic[email]",
         "python-dotenv",
         "torch",
         "transformers",
         "numpy",
-        "pinecone",          # ← changed from pinecone-client to pinecone
+        "pyahocorasick",
+        "cachetools",
+        "pinecone[grpc]",    # ← changed from pinecone-client to pinecone
         "groq",
+        "httpx[http2]",
         "pymongo",
+        "motor",
         "certifi",
     ])
     .run_function(download_biobert)
@@ -1,6 +1,5 @@
 import json
 import logging
-import re
 from pathlib import Path
 from typing import List, Dict, Set
 from collections import defaultdict
@@ -20,14 +19,12 @@ def deduplicate_scenarios(scenarios: List[Dict]) -> List[Dict]:
     
     for scenario in scenarios:
         
-        emergency = scenario.get('emergency_type', scenario.get('title', '')).lower().strip()
-        desc = scenario.get('description', '')[:150].lower().strip()
+        # split()/join collapses whitespace runs and trims, without a regex pass
+        emergency = ' '.join(scenario.get('emergency_type', scenario.get('title', '')).lower().split())
+        desc = ' '.join(scenario.get('description', '')[:150].lower().split())
         symptoms = str(scenario.get('symptoms', []))[:50].lower()
         aug_type = scenario.get('augmentation_type', '')
         
-        emergency = re.sub(r'\s+', ' ', emergency)
-        desc = re.sub(r'\s+', ' ', desc)
-        
         sig = f"{emergency}:{desc}:{symptoms}:{aug_type}"
         
         if sig not in seen:
@@ -0,0 +1,96 @@
+"""
+Concurrent identical queries share one retrieval + generation pass
+
+Drives FirstAidRAGAssistant.answer_query the way /api/query does (via
+asyncio.to_thread) without connecting to Pinecone, MongoDB or Groq.
+"""
+import asyncio
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from pathlib import Path
+from unittest import mock
+
+from cachetools import TTLCache
+
+# RAG modules import each other relative to backend/
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from RAG import rag
+from RAG.rag import FirstAidRAGAssistant
+from RAG.query_processor import QueryProcessor
+
+
+def make_assistant(answer_delay: float = 0.2, wait_for: threading.Event = None):
+    """
+    Assistant with only the state answer_query needs and a counting _answer_query
+
+    With wait_for, _answer_query holds until that event is set (or
+    answer_delay runs out) instead of sleeping
+    """
+    assistant = FirstAidRAGAssistant.__new__(FirstAidRAGAssistant)
+    assistant.query_processor = QueryProcessor()
+    assistant._inflight = {}
+    assistant._inflight_lock = threading.Lock()
+    assistant._response_cache = TTLCache(maxsize=16, ttl=60)
+
+    calls = []
+
+    def fake_answer_query(query, *args):
+        calls.append(query)
+        if wait_for is None:
+            time.sleep(answer_delay)
+        else:
+            wait_for.wait(answer_delay)
+        return {'query': query, 'response': 'Apply firm pressure.', 'confidence': 'high'}
+
+    assistant._answer_query = fake_answer_query
+    return assistant, calls
+
+
+class QuerySingleflightTest(unittest.TestCase):
+
+    def test_concurrent_identical_queries_answer_once(self):
+        joined = threading.Event()
+
+        class JoinedFuture(Future):
+            """Signals once a second request waits on the in-flight answer"""
+            def result(self, timeout=None):
+                joined.set()
+                return super().result(timeout)
+
+        # The leader answers only after the follower has joined it, so the
+        # follower cannot be served by the response cache instead
+        assistant, calls = make_assistant(answer_delay=5, wait_for=joined)
+
+        async def fire_two():
+            return await asyncio.gather(
+                asyncio.to_thread(assistant.answer_query, "How do I stop bleeding?"),
+                asyncio.to_thread(assistant.answer_query, "How do I stop bleeding?"),
+            )
+
+        with mock.patch.object(rag, "Future", JoinedFuture):
+            first, second = asyncio.run(fire_two())
+
+        self.assertTrue(joined.is_set())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(first['response'], second['response'])
+
+    def test_different_queries_are_not_merged(self):
+        assistant, calls = make_assistant(answer_delay=0.05)
+
+        async def fire_two():
+            return await asyncio.gather(
+                asyncio.to_thread(assistant.answer_query, "How do I stop bleeding?"),
+                asyncio.to_thread(assistant.answer_query, "How do I treat a burn?"),
+            )
+
+        asyncio.run(fire_two())
+
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()